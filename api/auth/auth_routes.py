@@ -1,21 +1,24 @@
 """Authentication routes"""
 from fastapi import APIRouter, HTTPException, Response, Request, Depends
 from core.models import RegisterIn, LoginIn
-from .utils import get_user_by_email
-from .dependencies import get_current_user
+from .utils import get_user_by_email, normalize_email
+from .passwords import hash_password, verify_password, verify_unknown
+from .dependencies import get_current_user, login_rate_limit, register_rate_limit
 from core.cache import ChatCache
-from core.config import SESSION_TTL
+from core.config import SESSION_TTL, UNKNOWN_EMAIL_TTL
 
 router = APIRouter(prefix="/auth")
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(register_rate_limit)])
 async def register(payload: RegisterIn, request: Request):
     """Register a new user"""
     pool = request.app.state.pool
-    existing_user = await get_user_by_email(pool, payload.email)
+    email = normalize_email(payload.email)
+    existing_user = await get_user_by_email(pool, email)
     if existing_user:
         raise HTTPException(status_code=409, detail="Email already registered")
-    
+
+    password_hash = await hash_password(payload.password)
     async with pool.acquire() as conn:
         row = await conn.fetchrow(
             """
@@ -23,20 +26,39 @@ async def register(payload: RegisterIn, request: Request):
             VALUES ($1, $2)
             RETURNING id, email, password, last_active_conversation_id
             """,
-            payload.email, payload.password,
+            email, password_hash,
         )
+    await request.app.state.cache.forget_unknown_email(email)
     return {"id": str(row["id"]), "email": row["email"]}
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(login_rate_limit)])
 async def login(payload: LoginIn, response: Response, request: Request):
     """Login user and create session"""
     pool = request.app.state.pool
     cache = request.app.state.cache
+    email = normalize_email(payload.email)
     
-    user = await get_user_by_email(pool, payload.email)
-    if not user or user["password"] != payload.password:
+    # Negative cache: repeated attempts on unknown emails don't reach Postgres.
+    # Unknown emails still pay a full verify, so response time matches a wrong password.
+    if await cache.is_unknown_email(email):
+        await verify_unknown(payload.password)
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    user = await get_user_by_email(pool, email)
+    if not user:
+        await cache.mark_unknown_email(email, ttl=UNKNOWN_EMAIL_TTL)
+        await verify_unknown(payload.password)
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
+    ok, new_hash = await verify_password(user["password"], payload.password)
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    # Transparent upgrade of plaintext rows and outdated hash parameters
+    if new_hash:
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE users SET password=$1 WHERE id=$2", new_hash, user["id"])
+
     # Create session
     sid = await cache.create_session(user["id"], ttl=SESSION_TTL)
 
@@ -1,10 +1,19 @@
 """Auth dependencies for FastAPI"""
 from fastapi import HTTPException, Request
-from .utils import get_user_by_id
-from core.config import SESSION_TTL
+from .utils import get_user_by_id, normalize_email
+from core.config import (
+    SESSION_TTL, RATE_LIMIT_WINDOW_SECONDS,
+    LOGIN_LIMIT_PER_IP, LOGIN_LIMIT_PER_EMAIL, REGISTER_LIMIT_PER_IP,
+)
+from core.metrics import span
+from core.proxies import client_ip
 
 async def get_current_user(request: Request):
     """Dependency to get current authenticated user"""
+    with span("auth"):
+        return await _resolve_user(request)
+
+async def _resolve_user(request: Request):
     sid = request.cookies.get("sid") or request.headers.get("x-sid")
     if not sid:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -23,4 +32,35 @@ async def get_current_user(request: Request):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"id": str(user["id"]), "email": user["email"]}
\ No newline at end of file
+    return {"id": str(user["id"]), "email": user["email"]}
+
+async def _enforce(request: Request, limits: dict):
+    allowed, retry_after = await request.app.state.cache.hit_rate_limit(
+        limits, window=RATE_LIMIT_WINDOW_SECONDS
+    )
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+async def _body_email(request: Request):
+    # Starlette caches the body, so the route can still parse it afterwards
+    try:
+        email = (await request.json()).get("email")
+    except Exception:
+        return None
+    return normalize_email(email) if isinstance(email, str) else None
+
+async def login_rate_limit(request: Request):
+    """Dependency limiting login attempts per client IP and per email"""
+    limits = {f"login:ip:{client_ip(request)}": LOGIN_LIMIT_PER_IP}
+    email = await _body_email(request)
+    if email:
+        limits[f"login:email:{email}"] = LOGIN_LIMIT_PER_EMAIL
+    await _enforce(request, limits)
+
+async def register_rate_limit(request: Request):
+    """Dependency limiting registrations per client IP"""
+    await _enforce(request, {f"register:ip:{client_ip(request)}": REGISTER_LIMIT_PER_IP})
@@ -0,0 +1,57 @@
+"""Password hashing off the event loop"""
+import asyncio
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from core.config import PASSWORD_HASH_WORKERS, ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM
+from core.metrics import span, PASSWORD_HASH_PENDING
+
+_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+# argon2 releases the GIL, so a small thread pool bounds CPU use without blocking the loop
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+# Verified against for unknown emails, so they cost as much as a wrong password
+_DUMMY_HASH = _hasher.hash(secrets.token_urlsafe(16))
+
+async def _run(stage, fn, *args):
+    PASSWORD_HASH_PENDING.inc()
+    try:
+        with span(stage):
+            return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        PASSWORD_HASH_PENDING.dec()
+
+def _verify(stored, password):
+    if not stored.startswith("$argon2"):
+        # legacy plaintext row; always rehashed after a successful login
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+    try:
+        _hasher.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, _hasher.check_needs_rehash(stored)
+
+async def hash_password(password: str) -> str:
+    return await _run("password_hash", _hasher.hash, password)
+
+async def verify_password(stored: str, password: str):
+    """
+    Check a password against the stored value.
+
+    Returns:
+        (ok, new_hash): new_hash is set when the stored value is plaintext
+        or was hashed with outdated parameters and should be replaced
+    """
+    ok, needs_rehash = await _run("password_verify", _verify, stored, password)
+    if ok and needs_rehash:
+        return True, await hash_password(password)
+    return ok, None
+
+async def verify_unknown(password: str) -> None:
+    """Spend a full verify for an email with no account, so timing doesn't reveal which emails exist"""
+    await _run("password_verify", _verify, _DUMMY_HASH, password)
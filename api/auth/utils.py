@@ -1,11 +1,15 @@
 """Database utilities for user management"""
 
+def normalize_email(email):
+    """The form every lookup, rate-limit and cache key uses"""
+    return email.strip().lower()
+
 async def get_user_by_email(pool, email):
-    """Get user by email address"""
+    """Get user by email address, case-insensitively (users_email_lower_idx)"""
     async with pool.acquire() as conn:
         return await conn.fetchrow(
-            "SELECT id, email, password, last_active_conversation_id FROM users WHERE email=$1",
-            email,
+            "SELECT id, email, password, last_active_conversation_id FROM users WHERE lower(email)=$1",
+            normalize_email(email),
         )
 
 async def get_user_by_id(pool, user_id):
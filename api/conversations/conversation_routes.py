@@ -1,88 +1,128 @@
 """Conversation and message routes"""
+import json
 from fastapi import APIRouter, HTTPException, Depends, Request
-from core.models import ConversationCreate, MessageIn
+from fastapi.responses import StreamingResponse
+from core.models import ConversationCreate, MessageIn, ReplyIn
 from api.auth.dependencies import get_current_user
+from api.conversations.responses import validators, is_fresh, not_modified, json_response
+from core.database import get_current_conversation, get_sidebar, get_recent_messages
+from core.archive import ensure_hot
+from core.search import search_conversations
+from core.config import CONVERSATION_CACHE_TTL, HISTORY_CACHE_SIZE, SIDEBAR_LIMIT, SEARCH_PAGE_SIZE
+from services.chatbot import request_reply, relay_reply, BUSY_MESSAGE
+from services.tenants import tenant_for_request
 
 router = APIRouter(prefix="/conversations")
 
 @router.get("/boot")
 async def boot_info(request: Request, user=Depends(get_current_user)):
-    """Returns sidebar and last active conversation on load"""
+    """
+    Returns sidebar and last active conversation on load.
+
+    Read-only: a user without a current conversation gets
+    last_conversation_id None and should call POST /bootstrap.
+    """
     pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        last_active = await conn.fetchval(
-            "SELECT last_active_conversation_id FROM users WHERE id=$1",
-            user["id"],
-        )
+    cache = request.app.state.cache
+    # Versions are read before the data, so a concurrent change only costs a refetch
+    sidebar_version = await cache.get_sidebar_version(user["id"])
+    last_active = await get_current_conversation(pool, cache, user["id"])
+    history_version = await cache.get_history_version(last_active) if last_active else 0
+    pending = await cache.get_reply_checkpoint(last_active) if last_active else None
 
-        if not last_active:
-            row = await conn.fetchrow(
-                """
-                INSERT INTO conversations (user_id, title)
-                VALUES ($1, $2)
-                RETURNING id::text
-                """,
-                user["id"], "New Conversation",
-            )
-            last_active = row["id"]
-            await conn.execute(
-                "UPDATE users SET last_active_conversation_id=$1 WHERE id=$2",
-                last_active, user["id"]
-            )
-            
-        conversations = await conn.fetch(
-            """
-            SELECT id::text, COALESCE(title,'') AS title, updated_at
-            FROM conversations
-            WHERE user_id=$1
-            ORDER BY updated_at DESC
-            LIMIT 100
-            """,
-            user["id"]
-        )   
-        print("SIDEBAR RETRIEVED")
+    headers = {"Cache-Control": "no-store"}
+    if not pending:  # a reply still being generated changes on every checkpoint
+        etag = f'W/"boot-{sidebar_version}-{last_active}-{history_version}"'
+        headers = validators(etag)
+        if is_fresh(request, etag):
+            return not_modified(headers)
 
-        msgs = await conn.fetch(
-            """
-            SELECT role, content
-            FROM messages
-            WHERE conversation_id=$1
-            ORDER BY id ASC
-            LIMIT 200
-            """,
-            last_active
-        )
-        print("MESSAGES RETRIEVED")
+    conversations = await get_sidebar(pool, cache, user["id"])
+    print("SIDEBAR RETRIEVED")
 
-    return {
+    msgs = list(await get_recent_messages(pool, cache, last_active)) if last_active else []
+    print("MESSAGES RETRIEVED")
+    if pending:
+        msgs.append({"role": "assistant", "content": pending["content"]})
+
+    return json_response(request, {
         "user": user, 
         "last_conversation_id": last_active, 
-        "conversations": [
-            {"id": r["id"], "title": r["title"], "updated_at": r["updated_at"].isoformat()}
-            for r in conversations
-        ], 
-        "messages": [{"role": r["role"], "content": r["content"]} for r in msgs],
-    }
+        "conversations": conversations, 
+        "messages": msgs,
+    }, headers)
 
-@router.get("")
-async def list_conversations(request: Request, user=Depends(get_current_user)):
-    """List user's conversations"""
+@router.get("/current")
+async def current_conversation(request: Request, user=Depends(get_current_user)):
+    """The user's current conversation id, or None before bootstrap"""
+    return {"conversation_id": await get_current_conversation(request.app.state.pool, request.app.state.cache, user["id"])}
+
+@router.post("/bootstrap")
+async def bootstrap(request: Request, user=Depends(get_current_user)):
+    """Make sure the user has a current conversation, creating one if needed; safe to repeat"""
     pool = request.app.state.pool
+    cache = request.app.state.cache
+    current = await get_current_conversation(pool, cache, user["id"])
+    if current:
+        return {"id": current, "created": False}
+
     async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT id::text, COALESCE(title,'') AS title, updated_at
-            FROM conversations
-            WHERE user_id=$1
-            ORDER BY updated_at DESC
-            LIMIT 100
-            """,
-            user["id"]
-        )
-    return [
-        {"id": r["id"], "title": r["title"], "updated_at": r["updated_at"].isoformat()}
-        for r in rows
-    ]
+        async with conn.transaction():
+            # Row lock, so concurrent bootstraps create a single conversation
+            current = await conn.fetchval(
+                "SELECT last_active_conversation_id::text FROM users WHERE id=$1 FOR UPDATE",
+                user["id"],
+            )
+            row = None
+            if not current:
+                row = await conn.fetchrow(
+                    """
+                    INSERT INTO conversations (user_id, title)
+                    VALUES ($1, $2)
+                    RETURNING id::text, title, updated_at
+                    """,
+                    user["id"], "New Conversation",
+                )
+                current = row["id"]
+                await conn.execute(
+                    "UPDATE users SET last_active_conversation_id=$1 WHERE id=$2",
+                    current, user["id"]
+                )
+
+    await cache.set_active_conversation(user["id"], current, ttl=CONVERSATION_CACHE_TTL)
+    if row is None:
+        return {"id": current, "created": False}
+    await cache.add_to_sidebar(
+        user["id"],
+        {"id": row["id"], "title": row["title"], "updated_at": row["updated_at"].isoformat()},
+        max_len=SIDEBAR_LIMIT,
+    )
+    return {"id": row["id"], "title": row["title"], "created": True}
+
+@router.get("")
+async def list_conversations(request: Request, user=Depends(get_current_user)):
+    """List user's conversations; 304 if the client's ETag still matches the sidebar version"""
+    cache = request.app.state.cache
+    # read the version before the data: a concurrent change then only costs a refetch
+    etag = f'W/"sidebar-{await cache.get_sidebar_version(user["id"])}"'
+    headers = validators(etag)
+    if is_fresh(request, etag):
+        return not_modified(headers)
+    return json_response(request, await get_sidebar(request.app.state.pool, cache, user["id"]), headers)
+
+@router.get("/search")
+async def search(request: Request, q: str = "", limit: int = SEARCH_PAGE_SIZE, offset: int = 0, user=Depends(get_current_user)):
+    """Search the user's conversation titles and messages"""
+    q = q.strip()
+    if not q:
+        return {"results": [], "next_offset": None}
+    limit = max(1, min(limit, 50))
+    offset = max(0, offset)
+    results = await search_conversations(request.app.state.pool, user["id"], q, limit, offset)
+    return {
+        "results": results,
+        "next_offset": offset + limit if len(results) == limit else None,
+    }
 
 @router.post("")
 async def create_conversation(payload: ConversationCreate, request: Request, user=Depends(get_current_user)):
@@ -101,42 +141,53 @@ async def create_conversation(payload: ConversationCreate, request: Request, use
             "UPDATE users SET last_active_conversation_id=$1 WHERE id=$2",
             row["id"], user["id"]
         )
-        return {"id": row["id"], "title": row["title"]}
+    await request.app.state.cache.set_active_conversation(user["id"], row["id"], ttl=CONVERSATION_CACHE_TTL)
+    await request.app.state.cache.add_to_sidebar(
+        user["id"],
+        {"id": row["id"], "title": row["title"], "updated_at": row["updated_at"].isoformat()},
+        max_len=SIDEBAR_LIMIT,
+    )
+    return {"id": row["id"], "title": row["title"]}
 
 @router.get("/{conversation_id}/messages")
 async def get_messages(conversation_id: str, request: Request, limit: int = 200, user=Depends(get_current_user)):
-    """Get messages for a conversation"""
+    """Get messages for a conversation; 304 if the client's copy is current"""
     pool = request.app.state.pool
+    cache = request.app.state.cache
     async with pool.acquire() as conn:
-        ok = await conn.fetchval(
-            "SELECT 1 FROM conversations WHERE id=$1 AND user_id=$2",
+        updated_at = await conn.fetchval(
+            "SELECT updated_at FROM conversations WHERE id=$1 AND user_id=$2",
             conversation_id, user["id"]
         )
-        if not ok:
+        if updated_at is None:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         await conn.execute(
             """
             UPDATE users SET last_active_conversation_id=$1
-            WHERE id=$2
+            WHERE id=$2 AND last_active_conversation_id IS DISTINCT FROM $1
             """,
             conversation_id, user["id"]
         )
+    await cache.set_active_conversation(user["id"], conversation_id, ttl=CONVERSATION_CACHE_TTL)
+
+    # Version before data, so a concurrent change only costs a refetch
+    version = await cache.get_history_version(conversation_id)
+    pending = await cache.get_reply_checkpoint(conversation_id)
+    headers = {"Cache-Control": "no-store"}
+    if not pending:  # a reply still being generated changes on every checkpoint
+        etag = f'W/"messages-{conversation_id}-{version}-{limit}"'
+        headers = validators(etag, updated_at)
+        if is_fresh(request, etag):
+            return not_modified(headers)
+
+    # Served from the hot cache; only the most recent HISTORY_CACHE_SIZE messages are kept
+    msgs = await get_recent_messages(pool, cache, conversation_id)
+    msgs = list(msgs[-limit:]) if limit > 0 else []
+    if pending:
+        msgs.append({"role": "assistant", "content": pending["content"]})
+    return json_response(request, msgs, headers)
 
-        rows = await conn.fetch(
-            """
-            SELECT role, content
-            FROM messages
-            WHERE conversation_id=$1
-            ORDER BY position ASC
-            LIMIT $2
-            """,
-            conversation_id, limit,
-        )
-        print("rows")
-        print([{"role": r["role"], "content": r["content"]} for r in rows])
-        return [{"role": r["role"], "content": r["content"]} for r in rows]
-    
 @router.post("/{conversation_id}/messages")
 async def add_message(conversation_id: str, payload: MessageIn, request: Request, user=Depends(get_current_user)):
     """Add a message to a conversation"""
@@ -149,28 +200,78 @@ async def add_message(conversation_id: str, payload: MessageIn, request: Request
         if not ok:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
+        async with conn.transaction():
+            await ensure_hot(conn, conversation_id)
+            await conn.execute(
+                """
+                INSERT INTO messages (conversation_id, role, content)
+                VALUES ($1, $2, $3)
+                """,
+                conversation_id, payload.role, payload.content
+            )
+            await conn.execute(
+                """
+                UPDATE conversations SET updated_at=now()
+                WHERE id=$1
+                """,
+                conversation_id
+            )
         await conn.execute(
             """
-            INSERT INTO messages (conversation_id, role, content)
-            VALUES ($1, $2, $3)
+            UPDATE users SET last_active_conversation_id=$1
+            WHERE id=$2 AND last_active_conversation_id IS DISTINCT FROM $1
             """,
-            conversation_id, payload.role, payload.content
+            conversation_id, user["id"]
         )
-        await conn.execute(
-            """
-            UPDATE conversations SET updated_at=now()
-            WHERE id=$1
-            """,
-            conversation_id
+
+    # Write-through to the hot cache
+    cache = request.app.state.cache
+    await cache.set_active_conversation(user["id"], conversation_id, ttl=CONVERSATION_CACHE_TTL)
+    await cache.store_message(
+        conversation_id, payload.role, payload.content,
+        max_len=HISTORY_CACHE_SIZE, ttl=CONVERSATION_CACHE_TTL,
+    )
+    await cache.touch_sidebar(user["id"], conversation_id, ttl=CONVERSATION_CACHE_TTL)
+    return {"ok": True}
+
+@router.post("/{conversation_id}/reply")
+async def create_reply(conversation_id: str, payload: ReplyIn, request: Request, user=Depends(get_current_user)):
+    """Queue an assistant reply; any worker generates it, stream it from /reply/stream"""
+    pool = request.app.state.pool
+    async with pool.acquire() as conn:
+        ok = await conn.fetchval(
+            "SELECT 1 FROM conversations WHERE id=$1 AND user_id=$2",
+            conversation_id, user["id"]
         )
-        await conn.execute(
-            """
-            UPDATE users SET last_active_conversation_id=$1
-            WHERE id=$2
-            """,
+        if not ok:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+    tenant = tenant_for_request(request)
+    after = await request_reply(request.app.state.cache, user["id"], payload.content, conversation_id, tenant.id)
+    if after is None:
+        raise HTTPException(status_code=503, detail=BUSY_MESSAGE)
+    return {"after": after}
+
+@router.get("/{conversation_id}/reply/stream")
+async def stream_reply(conversation_id: str, request: Request, after: str = "0", user=Depends(get_current_user)):
+    """Relay a reply from the conversation's Redis stream as NDJSON deltas"""
+    pool = request.app.state.pool
+    async with pool.acquire() as conn:
+        ok = await conn.fetchval(
+            "SELECT 1 FROM conversations WHERE id=$1 AND user_id=$2",
             conversation_id, user["id"]
         )
-        return {"ok": True}
+        if not ok:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+    async def relay():
+        try:
+            async for delta in relay_reply(request.app.state.cache, conversation_id, after):
+                yield json.dumps({"delta": delta}) + "\n"
+        except (RuntimeError, TimeoutError) as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
 
 @router.put("/{conversation_id}/title")
 async def update_conversation_title(conversation_id: str, title: str, request: Request, user=Depends(get_current_user)):
@@ -193,7 +294,8 @@ async def update_conversation_title(conversation_id: str, title: str, request: R
             """,
             title, conversation_id
         )
-        return {"ok": True, "title": title}
+    await request.app.state.cache.touch_sidebar(user["id"], conversation_id, ttl=CONVERSATION_CACHE_TTL, title=title)
+    return {"ok": True, "title": title}
 
 @router.get("/{conversation_id}/is-first-message")
 async def is_first_message(conversation_id: str, request: Request, user=Depends(get_current_user)):
@@ -0,0 +1,213 @@
+"""Bulk conversation export and import"""
+import json
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from api.auth.dependencies import get_current_user
+from core.archive import decompress_messages
+from core.config import EXPORT_PREFETCH, IMPORT_BATCH_SIZE
+
+router = APIRouter(prefix="/conversations")
+
+# =============================================================================
+# EXPORT
+# =============================================================================
+
+async def iter_export_records(pool, user_id):
+    """
+    Yield a user's conversations and messages as flat records.
+
+    Rows are read through server-side cursors, so memory stays flat however
+    much history the user has. Each conversation record is followed by its
+    messages; archived conversations are decompressed on the fly.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            current = None
+            async for r in conn.cursor(
+                """
+                SELECT c.id::text AS conversation_id, COALESCE(c.title,'') AS title, c.updated_at,
+                       m.role, m.content
+                FROM conversations c
+                LEFT JOIN messages m ON m.conversation_id = c.id
+                WHERE c.user_id=$1
+                ORDER BY c.id, m.id
+                """,
+                user_id, prefetch=EXPORT_PREFETCH,
+            ):
+                if r["conversation_id"] != current:
+                    current = r["conversation_id"]
+                    yield {
+                        "type": "conversation",
+                        "id": current,
+                        "title": r["title"],
+                        "updated_at": r["updated_at"].isoformat(),
+                    }
+                if r["role"] is not None:
+                    yield {"type": "message", "conversation_id": current, "role": r["role"], "content": r["content"]}
+
+            async for r in conn.cursor(
+                """
+                SELECT a.conversation_id::text AS conversation_id, a.payload
+                FROM conversation_archives a
+                JOIN conversations c ON c.id = a.conversation_id
+                WHERE c.user_id=$1
+                """,
+                user_id, prefetch=max(1, EXPORT_PREFETCH // 100),
+            ):
+                for m in decompress_messages(r["payload"]):
+                    yield {"type": "message", "conversation_id": r["conversation_id"], "role": m["role"], "content": m["content"]}
+
+async def ndjson_export(pool, user_id):
+    async for record in iter_export_records(pool, user_id):
+        yield json.dumps(record) + "\n"
+
+class ChunkSink:
+    """
+    Write-only file for ParquetWriter whose bytes are handed over and
+    cleared after every row group, so only one row group is held at a time
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return chunk
+
+async def parquet_export(pool, user_id):
+    """One row per message, written out a row group at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("conversation_id", pa.string()),
+        ("title", pa.string()),
+        ("role", pa.string()),
+        ("content", pa.string()),
+    ])
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+
+    titles, batch = {}, []
+    async for record in iter_export_records(pool, user_id):
+        if record["type"] == "conversation":
+            titles[record["id"]] = record["title"]
+            continue
+        batch.append(record | {"title": titles.get(record["conversation_id"], "")})
+        if len(batch) >= EXPORT_PREFETCH:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            batch = []
+            yield sink.take()
+    if batch:
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    writer.close()
+    yield sink.take()
+
+@router.get("/export")
+async def export_conversations(request: Request, format: str = "ndjson", user=Depends(get_current_user)):
+    """Stream all of the user's conversations as NDJSON or Parquet"""
+    pool = request.app.state.pool
+    if format == "ndjson":
+        return StreamingResponse(
+            ndjson_export(pool, user["id"]),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+        )
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Parquet export is not available on this server")
+        return StreamingResponse(
+            parquet_export(pool, user["id"]),
+            media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": 'attachment; filename="conversations.parquet"'},
+        )
+    raise HTTPException(status_code=400, detail="format must be ndjson or parquet")
+
+# =============================================================================
+# IMPORT
+# =============================================================================
+
+async def iter_ndjson(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+@router.post("/import")
+async def import_conversations(request: Request, user=Depends(get_current_user)):
+    """
+    Import an NDJSON export into the user's account.
+
+    Conversations get new ids; messages are loaded with COPY in batches of
+    IMPORT_BATCH_SIZE. The whole import is one transaction.
+    """
+    pool = request.app.state.pool
+    id_map = {}
+    pending = []
+    conversations = messages = 0
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            async def flush():
+                await conn.copy_records_to_table(
+                    "messages", records=pending, columns=["conversation_id", "role", "content"]
+                )
+                pending.clear()
+
+            try:
+                async for record in iter_ndjson(request):
+                    if record.get("type") == "conversation":
+                        new_id = await conn.fetchval(
+                            """
+                            INSERT INTO conversations (user_id, title)
+                            VALUES ($1, $2)
+                            RETURNING id
+                            """,
+                            user["id"], record.get("title") or "Imported Conversation",
+                        )
+                        id_map[record["id"]] = new_id
+                        conversations += 1
+                    elif record.get("type") == "message":
+                        if record["conversation_id"] not in id_map:
+                            raise HTTPException(status_code=400, detail="Message before its conversation record")
+                        pending.append((id_map[record["conversation_id"]], record["role"], record["content"]))
+                        messages += 1
+                        if len(pending) >= IMPORT_BATCH_SIZE:
+                            await flush()
+            except (ValueError, KeyError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid import record: {e}")
+            if pending:
+                await flush()
+
+    await request.app.state.cache.invalidate_sidebar(user["id"])
+    return {"ok": True, "conversations": conversations, "messages": messages}
@@ -0,0 +1,73 @@
+"""Conditional GET, compression and fast JSON for conversation reads"""
+import gzip
+import json
+from datetime import timezone
+from email.utils import format_datetime
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # stdlib json is slower but produces the same output
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode()
+
+def validators(etag, last_modified=None):
+    """Headers letting the client revalidate instead of refetching"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def is_fresh(request: Request, etag) -> bool:
+    """
+    Whether the client's copy is current, by If-None-Match only.
+
+    If-Modified-Since is ignored: at one-second resolution it can't tell a
+    reply saved in the same second as the client's copy from no change.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def not_modified(headers):
+    return Response(status_code=304, headers=headers)
+
+def accepted_encodings(request: Request):
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        try:
+            if params and float(params.strip().removeprefix("q=")) == 0:
+                continue  # explicitly refused
+        except ValueError:
+            pass
+        accepted.add(name.strip().lower())
+    return accepted
+
+def json_response(request: Request, content, headers=None):
+    """JSON body, brotli- or gzip-compressed when it is large enough and the client accepts it"""
+    body = dumps(content)
+    headers = dict(headers or {})
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,132 @@
+"""
+Classifier throughput benchmark.
+
+Runs the zero-shot classifier from services.classifier over a fixed corpus
+for every combination of batch size and intra-op thread count, reporting
+messages/sec, per-batch latency percentiles, peak RSS and label agreement
+against a reference run.
+
+The model and device are selected with CLASSIFIER_MODEL / CLASSIFIER_DEVICE,
+so different backends are compared by running the script once per setting.
+--staged benchmarks the two-stage classifier (one message at a time) and
+also reports the average number of NLI pairs evaluated per message.
+
+Usage:
+    python -m bench.classifier_bench --batch-sizes 1,4,8 --threads 1,2,4 --json run.json
+    python -m bench.classifier_bench --reference run.json --staged
+"""
+import argparse
+import json
+import resource
+import time
+from bench.corpus import MESSAGES
+from bench.load_test import percentiles
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+def run_config(classifier, candidate_labels, messages, batch_size, repeat):
+    latencies = []
+    labels = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        labels = []
+        for i in range(0, len(messages), batch_size):
+            batch = messages[i:i + batch_size]
+            t0 = time.perf_counter()
+            results = classifier(batch, candidate_labels=candidate_labels, batch_size=batch_size)
+            latencies.append(time.perf_counter() - t0)
+            labels.extend(r["labels"][0] for r in results)
+    elapsed = time.perf_counter() - start
+    return {
+        "messages_per_second": len(messages) * repeat / elapsed,
+        "batch_latency_s": percentiles(latencies),
+        "labels": labels,
+    }
+
+def run_staged(classify_staged, messages, repeat):
+    latencies = []
+    labels = []
+    pairs = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        labels = []
+        for message in messages:
+            t0 = time.perf_counter()
+            result = classify_staged(message)
+            latencies.append(time.perf_counter() - t0)
+            labels.append(result["label"])
+            pairs += result["pairs"]
+    elapsed = time.perf_counter() - start
+    return {
+        "messages_per_second": len(messages) * repeat / elapsed,
+        "batch_latency_s": percentiles(latencies),
+        "avg_pairs": pairs / (len(messages) * repeat),
+        "labels": labels,
+    }
+
+def agreement(labels, reference):
+    if not reference:
+        return None
+    same = sum(1 for a, b in zip(labels, reference) if a == b)
+    return same / len(reference)
+
+def main():
+    parser = argparse.ArgumentParser(description="Classifier throughput benchmark")
+    parser.add_argument("--batch-sizes", default="1,4,8", help="comma-separated batch sizes")
+    parser.add_argument("--threads", default="1,2,4", help="comma-separated torch intra-op thread counts")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the corpus per configuration")
+    parser.add_argument("--staged", action="store_true", help="benchmark the two-stage classifier (batch size 1)")
+    parser.add_argument("--reference", help="results JSON from a reference run to compare labels against")
+    parser.add_argument("--json", help="write machine-readable results to this path")
+    args = parser.parse_args()
+
+    import torch
+    from services import classifier as clf
+
+    reference = None
+    if args.reference:
+        with open(args.reference) as f:
+            reference = json.load(f)["reference_labels"]
+
+    # Warm up once so model load and first-call overhead aren't measured
+    clf.get_classifier()(MESSAGES[0], candidate_labels=clf.CANDIDATE_LABELS)
+
+    results = []
+    print(f"{'batch':>6}{'threads':>8}{'msg/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}{'agree':>7}")
+    batch_sizes = [1] if args.staged else [int(x) for x in args.batch_sizes.split(",")]
+    for threads in [int(x) for x in args.threads.split(",")]:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            if args.staged:
+                run = run_staged(clf.classify_staged, MESSAGES, args.repeat)
+            else:
+                run = run_config(clf.get_classifier(), clf.CANDIDATE_LABELS, MESSAGES, batch_size, args.repeat)
+            if reference is None:
+                reference = run["labels"]
+            run.update({
+                "batch_size": batch_size,
+                "threads": threads,
+                "peak_rss_mb": peak_rss_mb(),
+                "label_agreement": agreement(run["labels"], reference),
+            })
+            results.append(run)
+
+            p = run["batch_latency_s"]
+            print(f"{batch_size:>6}{threads:>8}{run['messages_per_second']:>9.2f}"
+                  f"{p['p50']*1000:>10.1f}{p['p95']*1000:>10.1f}{p['p99']*1000:>10.1f}"
+                  f"{run['peak_rss_mb']:>9.0f}{run['label_agreement']:>7.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "model": clf.CLASSIFIER_MODEL,
+                "staged": args.staged,
+                "device": clf.CLASSIFIER_DEVICE,
+                "corpus_size": len(MESSAGES),
+                "reference_labels": reference,
+                "runs": results,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Fixed corpus of telecom support messages for classifier benchmarks"""
+
+MESSAGES = [
+    # billing
+    "I was charged twice for my internet this month",
+    "Why is my bill $40 higher than last month?",
+    "My credit card payment failed, how do I retry it?",
+    "I need a refund for the days the service was down",
+    "Can you send me a copy of my March invoice?",
+    "There is an extra equipment fee on my statement I never agreed to",
+    "autopay took money from the wrong account",
+    # connectivity
+    "My internet keeps dropping every few minutes",
+    "Speeds are really slow in the evening, like 2 Mbps",
+    "No internet since this morning, all lights are on",
+    "Video calls lag constantly and I see packet loss",
+    "The connection disconnects whenever it rains",
+    "ping to game servers is over 200ms",
+    "step 3 didn't work, still offline",
+    # device_config
+    "How do I change my wifi password?",
+    "I need to set up port forwarding for my game console",
+    "The router firmware update is stuck at 80%",
+    "How can I rename my SSID?",
+    "My new modem shows a red light after setup",
+    "Which menu has the DNS settings on the router?",
+    "how do I enable the 5GHz band",
+    # cancellation
+    "I want to cancel my service",
+    "Can I pause my account while I travel for 3 months?",
+    "Please downgrade me to the basic plan",
+    "I'd like to upgrade to the gigabit plan",
+    "How do I terminate my contract early?",
+    "stop my plan at the end of the month",
+    # general_info
+    "What plans do you offer in my area?",
+    "Is fiber available at 42 Oak Street?",
+    "Do you have any promotions for new customers?",
+    "How much is the 500 Mbps plan?",
+    "Does your coverage include rural areas?",
+    "what's the difference between the standard and premium plans",
+    # chitchat
+    "Hi there!",
+    "Thanks, that fixed it",
+    "Good morning, how are you?",
+    "ok",
+    "yes",
+    "you're very helpful, thank you",
+    "hello again",
+]
@@ -0,0 +1,151 @@
+"""
+End-to-end latency benchmark.
+
+Runs the FastAPI app against the Postgres/Redis configured in the
+environment (DATABASE_URL, REDIS_*), with a stub OpenAI server, an
+in-memory Kafka sink and a stubbed classifier, then drives concurrent
+simulated users through login -> boot -> send.
+
+The send step makes the same REST calls as ui/chat.on_send (save the user
+message, request a reply, relay it from /reply/stream); the Gradio
+websocket transport itself is not measured.
+
+The database must have been migrated first (python -m core.migrate).
+
+Usage:
+    python -m bench.load_test --users 20 --messages 5 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+STUB_PORT = 8765
+APP_PORT = 8766
+
+def percentiles(samples):
+    if not samples:
+        return {"n": 0, "p50": None, "p95": None, "p99": None}
+    if len(samples) == 1:
+        q = samples * 99
+    else:
+        q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"n": len(samples), "p50": q[49], "p95": q[94], "p99": q[98]}
+
+async def serve(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()  # surface startup errors
+        await asyncio.sleep(0.05)
+    return server, task
+
+async def simulated_user(client, run_id, index, messages, timings):
+    email = f"bench-{run_id}-{index}@example.com"
+    await client.post("/auth/register", json={"email": email, "password": "bench"})
+
+    start = time.perf_counter()
+    resp = await client.post("/auth/login", json={"email": email, "password": "bench"})
+    timings["auth"].append(time.perf_counter() - start)
+    resp.raise_for_status()
+    headers = {"x-sid": resp.json()["sid"]}
+
+    start = time.perf_counter()
+    resp = await client.get("/conversations/boot", headers=headers)
+    resp.raise_for_status()
+    cid = resp.json()["last_conversation_id"]
+    if cid is None:  # new users get their first conversation from /bootstrap, as in ui/chat
+        resp = await client.post("/conversations/bootstrap", headers=headers)
+        resp.raise_for_status()
+        cid = resp.json()["id"]
+    timings["boot"].append(time.perf_counter() - start)
+
+    for n in range(messages):
+        text = f"My internet keeps dropping every few minutes ({n})"
+        start = time.perf_counter()
+        await client.post(f"/conversations/{cid}/messages", headers=headers,
+                          json={"role": "user", "content": text})
+        resp = await client.post(f"/conversations/{cid}/reply", headers=headers, json={"content": text})
+        resp.raise_for_status()
+
+        first = None
+        async with client.stream("GET", f"/conversations/{cid}/reply/stream", headers=headers,
+                                 params={"after": resp.json()["after"]}) as relay:
+            async for line in relay.aiter_lines():
+                if line and first is None:
+                    first = time.perf_counter()
+                    timings["ttft"].append(first - start)
+        timings["answer"].append(time.perf_counter() - start)
+
+async def run(args):
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["BASE_URL"] = f"http://127.0.0.1:{APP_PORT}"
+    # every simulated user comes from 127.0.0.1
+    for limit in ("LOGIN_LIMIT_PER_IP", "REGISTER_LIMIT_PER_IP"):
+        os.environ.setdefault(limit, "1000000")
+
+    from bench.stubs import install_classifier_stub, install_kafka_stub, sent_tickets
+    install_classifier_stub(latency_ms=args.classifier_ms)
+    install_kafka_stub()
+
+    import httpx
+    from bench.stub_openai import create_stub_app
+    from main import app
+
+    stub_server, stub_task = await serve(
+        create_stub_app(args.tokens_per_second, args.ttft_ms, args.decision_ms), STUB_PORT
+    )
+    app_server, app_task = await serve(app, APP_PORT)
+
+    timings = {"auth": [], "boot": [], "ttft": [], "answer": []}
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.users * 2)
+    started = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", limits=limits, timeout=60) as client:
+            await asyncio.gather(*[
+                simulated_user(client, run_id, i, args.messages, timings)
+                for i in range(args.users)
+            ])
+    finally:
+        app_server.should_exit = True
+        stub_server.should_exit = True
+        await asyncio.gather(app_task, stub_task)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "tickets_published": len(sent_tickets),
+        "latency_s": {stage: percentiles(samples) for stage, samples in timings.items()},
+    }
+
+    print(f"{'stage':<8}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, p in report["latency_s"].items():
+        if p["n"]:
+            print(f"{stage:<8}{p['n']:>6}{p['p50']*1000:>10.1f}{p['p95']*1000:>10.1f}{p['p99']*1000:>10.1f}")
+    print(f"Total: {elapsed:.2f} seconds")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot end-to-end latency benchmark")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--messages", type=int, default=3, help="messages sent per user")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub LLM streaming rate")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="stub LLM time to first token")
+    parser.add_argument("--decision-ms", type=float, default=400.0, help="stub LLM non-streaming latency")
+    parser.add_argument("--classifier-ms", type=float, default=0.0, help="stub classifier latency per message")
+    parser.add_argument("--json", help="write machine-readable results to this path")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
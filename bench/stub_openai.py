@@ -0,0 +1,70 @@
+"""OpenAI-compatible chat completions stand-in with a configurable token rate"""
+import asyncio
+import json
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+REPLY = (
+    "Please open the Settings menu, choose Network, then press Restart Router. "
+    "Wait two minutes for the lights to turn green and try the connection again. "
+    "If the problem continues, let me know which lights are blinking."
+)
+
+def create_stub_app(tokens_per_second: float = 50.0, ttft_ms: float = 300.0, decision_ms: float = 400.0):
+    """
+    Create the stub server app.
+
+    Args:
+        tokens_per_second: Streaming rate after the first token
+        ttft_ms: Delay before the first streamed token
+        decision_ms: Latency of non-streaming completions (decision pass, titles)
+    """
+    app = FastAPI()
+    tokens = [w + " " for w in REPLY.split()]
+
+    def chunk(completion_id, model, delta, finish_reason=None):
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def stream(completion_id, model):
+        await asyncio.sleep(ttft_ms / 1000)
+        yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / tokens_per_second)
+            yield chunk(completion_id, model, {"content": token})
+        yield chunk(completion_id, model, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            return StreamingResponse(stream(completion_id, model), media_type="text/event-stream")
+
+        await asyncio.sleep(decision_ms / 1000)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        }
+
+    return app
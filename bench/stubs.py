@@ -0,0 +1,67 @@
+"""In-process stand-ins for the classifier and Kafka"""
+import asyncio
+import time
+from collections import defaultdict, namedtuple
+
+sent_tickets = []
+
+def install_classifier_stub(label: str = "Internet Connectivity", confidence: float = 0.92, latency_ms: float = 0.0):
+    """
+    Replace the classifier's model calls before anything imports them, so
+    the DeBERTa model is never loaded. Label sets and follow-up detection
+    stay real.
+    """
+    import services.classifier as module
+
+    def classify(message, label_set=None):
+        if latency_ms:
+            time.sleep(latency_ms / 1000)  # CPU-bound like the real model
+        return label, confidence
+
+    async def classify_async(message, tenant=None):
+        return await asyncio.to_thread(classify, message)
+
+    module.get_classifier = lambda: None
+    module.classify = classify
+    module.classify_async = classify_async
+
+def install_kafka_stub(latency_ms: float = 5.0):
+    """Replace the Kafka publish in services.chatbot with an in-memory sink"""
+    import services.chatbot as chatbot
+
+    async def publish(topic, payload, key, bootstrap=None):
+        await asyncio.sleep(latency_ms / 1000)
+        if topic != chatbot.MESSAGES_TOPIC:
+            sent_tickets.append(payload)
+
+    chatbot.publish = publish
+
+FakeRecord = namedtuple("FakeRecord", "topic partition offset key value")
+FakePartition = namedtuple("FakePartition", "topic partition")
+
+class FakeKafkaConsumer:
+    """In-memory stand-in for AIOKafkaConsumer.getmany()"""
+
+    def __init__(self):
+        self.logs = defaultdict(list)
+        self.positions = defaultdict(int)
+
+    def produce(self, topic, value: bytes, key: bytes = b"", partition: int = 0):
+        tp = FakePartition(topic, partition)
+        self.logs[tp].append(FakeRecord(topic, partition, len(self.logs[tp]), key, value))
+
+    def seek(self, tp, offset):
+        self.positions[tp] = offset
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        batches = {}
+        remaining = max_records or float("inf")
+        for tp, log in self.logs.items():
+            records = log[self.positions[tp]:self.positions[tp] + int(min(remaining, len(log)))]
+            if records:
+                batches[tp] = records
+                self.positions[tp] += len(records)
+                remaining -= len(records)
+        if not batches:
+            await asyncio.sleep(timeout_ms / 1000)
+        return batches
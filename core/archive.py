@@ -0,0 +1,164 @@
+"""Cold storage for inactive conversations (table created by core.migrate)"""
+import asyncio
+import json
+import zstandard
+from core.config import (
+    ARCHIVE_AFTER_DAYS, ARCHIVE_RETENTION_DAYS, ARCHIVE_INTERVAL_SECONDS, ARCHIVE_BATCH_SIZE,
+)
+
+_compressor = zstandard.ZstdCompressor(level=10)
+_decompressor = zstandard.ZstdDecompressor()
+
+# =============================================================================
+# ARCHIVE / REHYDRATE
+# =============================================================================
+
+def compress_messages(messages):
+    return _compressor.compress(json.dumps(messages, separators=(",", ":")).encode())
+
+def decompress_messages(payload):
+    return json.loads(_decompressor.decompress(payload))
+
+async def archive_conversation(conn, conversation_id, inactive_days=ARCHIVE_AFTER_DAYS):
+    """
+    Move a conversation's messages into a single compressed archive row.
+
+    The conversation row is locked and its inactivity re-checked first:
+    writers bump updated_at in the same transaction as their insert, so a
+    conversation written to since it was picked is skipped. Only the rows
+    read here are deleted; a message committed meanwhile stays hot and is
+    merged back by rehydrate_conversation.
+    """
+    async with conn.transaction():
+        still_inactive = await conn.fetchval(
+            """
+            SELECT 1 FROM conversations c
+            WHERE c.id=$1 AND c.updated_at < now() - make_interval(days => $2)
+              AND NOT EXISTS (SELECT 1 FROM conversation_archives a WHERE a.conversation_id = c.id)
+            FOR UPDATE OF c
+            """,
+            conversation_id, inactive_days,
+        )
+        if not still_inactive:
+            return 0
+        rows = await conn.fetch(
+            "SELECT id, role, content FROM messages WHERE conversation_id=$1 ORDER BY id ASC FOR UPDATE",
+            conversation_id,
+        )
+        if not rows:
+            return 0
+        messages = [{"role": r["role"], "content": r["content"]} for r in rows]
+        await conn.execute(
+            """
+            INSERT INTO conversation_archives (conversation_id, message_count, payload)
+            VALUES ($1, $2, $3)
+            """,
+            conversation_id, len(messages), compress_messages(messages),
+        )
+        await conn.execute("DELETE FROM messages WHERE id = ANY($1)", [r["id"] for r in rows])
+        return len(messages)
+
+async def rehydrate_conversation(conn, conversation_id):
+    """
+    Move an archived conversation back into the hot messages table.
+
+    Messages already in the hot table (written since archiving) are moved
+    after the archived ones so the conversation stays in order.
+
+    Returns the conversation's messages, or an empty list if it isn't
+    archived.
+    """
+    async with conn.transaction():
+        payload = await conn.fetchval(
+            "DELETE FROM conversation_archives WHERE conversation_id=$1 RETURNING payload",
+            conversation_id,
+        )
+        if payload is None:
+            return []
+        newer = await conn.fetch(
+            "DELETE FROM messages WHERE conversation_id=$1 RETURNING id, role, content",
+            conversation_id,
+        )
+        messages = decompress_messages(payload) + [
+            {"role": r["role"], "content": r["content"]} for r in sorted(newer, key=lambda r: r["id"])
+        ]
+        await conn.executemany(
+            "INSERT INTO messages (conversation_id, role, content) VALUES ($1, $2, $3)",
+            [(conversation_id, m["role"], m["content"]) for m in messages],
+        )
+        return messages
+
+async def ensure_hot(conn, conversation_id):
+    """Rehydrate a conversation if it is archived; call before reading or writing its messages"""
+    archived = await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM conversation_archives WHERE conversation_id=$1)",
+        conversation_id,
+    )
+    if archived:
+        await rehydrate_conversation(conn, conversation_id)
+
+# =============================================================================
+# BACKGROUND ARCHIVER
+# =============================================================================
+
+async def archive_inactive(pool, cache):
+    """Archive one batch of conversations inactive for ARCHIVE_AFTER_DAYS"""
+    async with pool.acquire() as conn:
+        ids = await conn.fetch(
+            """
+            SELECT c.id
+            FROM conversations c
+            WHERE c.updated_at < now() - make_interval(days => $1)
+              AND NOT EXISTS (SELECT 1 FROM conversation_archives a WHERE a.conversation_id = c.id)
+              AND EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = c.id)
+              AND NOT EXISTS (SELECT 1 FROM users u WHERE u.last_active_conversation_id = c.id)
+            ORDER BY c.updated_at ASC
+            LIMIT $2
+            """,
+            ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE,
+        )
+        archived = 0
+        for r in ids:
+            if await archive_conversation(conn, r["id"]):
+                await cache.invalidate_history(r["id"])
+                archived += 1
+        return archived
+
+async def apply_retention(pool, cache):
+    """Drop archived conversations older than ARCHIVE_RETENTION_DAYS (0 keeps them forever)"""
+    if ARCHIVE_RETENTION_DAYS <= 0:
+        return 0
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            DELETE FROM conversations c
+            USING conversation_archives a
+            WHERE a.conversation_id = c.id
+              AND c.updated_at < now() - make_interval(days => $1)
+              AND NOT EXISTS (SELECT 1 FROM users u WHERE u.last_active_conversation_id = c.id)
+            RETURNING c.user_id
+            """,
+            ARCHIVE_RETENTION_DAYS,
+        )
+    for user_id in {r["user_id"] for r in rows}:
+        await cache.invalidate_sidebar(user_id)
+    return len(rows)
+
+async def run_archiver(pool, cache):
+    """Periodically archive inactive conversations and apply the retention policy"""
+    while True:
+        try:
+            archived = 0
+            while True:
+                batch = await archive_inactive(pool, cache)
+                archived += batch
+                if batch < ARCHIVE_BATCH_SIZE:
+                    break
+            purged = await apply_retention(pool, cache)
+            if archived or purged:
+                print(f"Archiver: archived {archived}, purged {purged} conversations")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Archiver error: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
@@ -1,13 +1,44 @@
 import json
+import time
 from datetime import datetime, timezone
 import uuid
 import secrets
 from typing import Optional, List
 from redis.asyncio import Redis
+from redis.exceptions import WatchError, ResponseError
+
+# Sliding-window limiter over several keys in one round trip.
+# KEYS: window keys; ARGV: window_ms, member, limit per key...
+# Returns {1, 0} if the hit was recorded on every key, else {0, retry_after_ms}.
+SLIDING_WINDOW_LUA = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local window = tonumber(ARGV[1])
+local retry = 0
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= tonumber(ARGV[i + 2]) then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry = math.max(retry, tonumber(oldest[2]) + window - now, 1)
+    end
+end
+if retry > 0 then
+    return {0, retry}
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, window)
+end
+return {1, 0}
+"""
+
+REPLY_JOBS = "reply-jobs"
+VERSION_TTL = 30 * 24 * 3600
 
 class ChatCache:
     def __init__(self, redis_client):
         self.redis = redis_client
+        self._sliding_window = redis_client.register_script(SLIDING_WINDOW_LUA)
 
     # ----------------------------
     # SESSION MANAGEMENT 
@@ -34,25 +65,287 @@ class ChatCache:
     async def close_session(self, session_id):
         await self.redis.delete(session_id)
 
+    # ----------------------------
+    # RATE LIMITING
+    # ----------------------------
+
+    async def hit_rate_limit(self, limits: dict, window: int = 60):
+        """
+        Record one hit against every key in `limits` ({key: max hits per window}).
+
+        Returns:
+            (allowed, retry_after_seconds)
+        """
+        keys = [f"rl:{k}" for k in limits]
+        member = secrets.token_hex(8)
+        allowed, retry_ms = await self._sliding_window(
+            keys=keys, args=[window * 1000, member, *limits.values()]
+        )
+        return bool(allowed), -(-int(retry_ms) // 1000)
+
+    async def is_unknown_email(self, email) -> bool:
+        return bool(await self.redis.exists(f"nouser:{email}"))
+
+    async def mark_unknown_email(self, email, ttl = 60):
+        await self.redis.setex(f"nouser:{email}", ttl, "1")
+
+    async def forget_unknown_email(self, email):
+        await self.redis.delete(f"nouser:{email}")
+
+    # ----------------------------
+    # IN-FLIGHT REPLY CHECKPOINTS
+    # ----------------------------
+
+    async def checkpoint_reply(self, conversation_id, content, ttl = 600):
+        # partial assistant reply, overwritten on every checkpoint
+        entry = json.dumps({
+            "content": content,
+            "ts": datetime.now(timezone.utc).isoformat()
+        })
+        await self.redis.setex(f"reply:{conversation_id}", ttl, entry)
+
+    async def get_reply_checkpoint(self, conversation_id) -> Optional[dict]:
+        raw = await self.redis.get(f"reply:{conversation_id}")
+        return json.loads(raw) if raw else None
+
+    async def clear_reply_checkpoint(self, conversation_id):
+        await self.redis.delete(f"reply:{conversation_id}")
+
+    # ----------------------------
+    # REPLY STREAMS AND GENERATION JOBS
+    # ----------------------------
+
+    async def _append_reply_stream(self, conversation_id, kind, data, ttl):
+        key = f"stream:{conversation_id}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(key, {"type": kind, "data": data}, maxlen=10000, approximate=True)
+        pipe.expire(key, ttl)
+        entry_id, _ = await pipe.execute()
+        return entry_id
+
+    async def start_reply_stream(self, conversation_id, ttl = 600) -> str:
+        # relays read after this id, so earlier replies aren't replayed
+        return await self._append_reply_stream(conversation_id, "start", "", ttl)
+
+    async def publish_reply_chunk(self, conversation_id, chunk, ttl = 600):
+        await self._append_reply_stream(conversation_id, "chunk", chunk, ttl)
+
+    async def finish_reply_stream(self, conversation_id, status = "ok", ttl = 600):
+        await self._append_reply_stream(conversation_id, "done", status, ttl)
+
+    async def read_reply_stream(self, conversation_id, after, block_ms = 2000):
+        resp = await self.redis.xread({f"stream:{conversation_id}": after}, count=100, block=block_ms)
+        return resp[0][1] if resp else []
+
+    async def ensure_reply_group(self, group):
+        try:
+            await self.redis.xgroup_create(REPLY_JOBS, group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def enqueue_reply_job(self, job: dict) -> str:
+        return await self.redis.xadd(REPLY_JOBS, {"job": json.dumps(job)}, maxlen=100000, approximate=True)
+
+    async def reply_backlog(self) -> int:
+        # acked jobs are deleted, so the stream length is what's still queued or running
+        return await self.redis.xlen(REPLY_JOBS)
+
+    async def claim_reply_jobs(self, group, consumer, count = 1, block_ms = 2000, min_idle_ms = 120000):
+        """Next jobs for this worker, retaking ones left pending by dead workers first"""
+        claimed = await self.redis.xautoclaim(REPLY_JOBS, group, consumer, min_idle_ms, "0-0", count=count)
+        entries = [(i, f) for i, f in claimed[1] if f]
+        if not entries:
+            resp = await self.redis.xreadgroup(group, consumer, {REPLY_JOBS: ">"}, count=count, block=block_ms)
+            entries = resp[0][1] if resp else []
+        return [(job_id, json.loads(fields["job"])) for job_id, fields in entries]
+
+    async def ack_reply_job(self, group, job_id):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(REPLY_JOBS, group, job_id)
+        pipe.xdel(REPLY_JOBS, job_id)
+        await pipe.execute()
+
+    # ----------------------------
+    # ESCALATION WINDOW
+    # ----------------------------
+
+    async def claim_escalation(self, user_id, ttl = 300) -> bool:
+        # atomic: only the first escalation in the window gets to create a ticket
+        entry = json.dumps({"ticket_id": None, "created_at": None})
+        return bool(await self.redis.set(f"esc:{user_id}", entry, nx=True, ex=ttl))
+
+    async def record_escalation(self, user_id, ticket_id, created_at) -> None:
+        entry = json.dumps({"ticket_id": str(ticket_id), "created_at": created_at.isoformat()})
+        await self.redis.set(f"esc:{user_id}", entry, xx=True, keepttl=True)
+
+    async def get_escalation(self, user_id) -> Optional[dict]:
+        raw = await self.redis.get(f"esc:{user_id}")
+        return json.loads(raw) if raw else None
+
+    async def release_escalation(self, user_id) -> None:
+        await self.redis.delete(f"esc:{user_id}")
+
+    # ----------------------------
+    # CONVERSATION CLASSIFICATION STATE
+    # ----------------------------
+
+    async def get_classification(self, conversation_id) -> Optional[dict]:
+        raw = await self.redis.get(f"clf:{conversation_id}")
+        return json.loads(raw) if raw else None
+
+    async def set_classification(self, conversation_id, label: str, confidence: float, turns: int = 0, ttl: int = 1800) -> None:
+        entry = json.dumps({"label": label, "confidence": confidence, "turns": turns})
+        await self.redis.setex(f"clf:{conversation_id}", ttl, entry)
+
+    # ----------------------------
+    # CONVERSATION CACHE (write-through, Postgres is source of truth)
+    # ----------------------------
+
+    async def store_message(self, conversation_id, role: str, content: str, max_len: int = 200, ttl: int = 3600) -> None:
+        history_key = f"chat:{conversation_id}"
+        entry = json.dumps({"role": role, "content": content})
+        # only append to a hot list; a cold one is filled from Postgres on next read
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.rpushx(history_key, entry)
+        pipe.ltrim(history_key, -max_len, -1)
+        pipe.expire(history_key, ttl)
+        # bumped even when the list is cold: the message is in Postgres either way
+        self._bump_version(pipe, f"chat:ver:{conversation_id}")
+        await pipe.execute()
+
+    async def get_history(self, conversation_id) -> Optional[List[dict]]:
+        history_key = f"chat:{conversation_id}"
+        raw = await self.redis.lrange(history_key, 0, -1)
+        # an empty conversation is never cached, so an empty list is a miss
+        return [json.loads(x) for x in raw] if raw else None
+
+    async def set_history(self, conversation_id, messages: List[dict], version: int, ttl: int = 3600) -> None:
+        """
+        Fill the hot list from a Postgres read, unless a message was stored
+        since `version` (read before the query), which the read may have missed
+        """
+        history_key = f"chat:{conversation_id}"
+        version_key = f"chat:ver:{conversation_id}"
+        if not messages:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(version_key)
+                if await pipe.get(version_key) != str(version):
+                    return  # stale; the next read refills
+                pipe.multi()
+                pipe.delete(history_key)
+                pipe.rpush(history_key, *[json.dumps(m) for m in messages])
+                pipe.expire(history_key, ttl)
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def invalidate_history(self, conversation_id) -> None:
+        await self.redis.delete(f"chat:{conversation_id}")
+
+    async def get_history_version(self, conversation_id, ttl: int = VERSION_TTL) -> int:
+        """Counter bumped with every stored message, for ETag validation"""
+        return await self._get_version(f"chat:ver:{conversation_id}", ttl)
+
+    async def get_active_conversation(self, user_id) -> Optional[str]:
+        return await self.redis.get(f"active:{user_id}")
+
+    async def set_active_conversation(self, user_id, conversation_id, ttl: int = 3600) -> None:
+        await self.redis.setex(f"active:{user_id}", ttl, str(conversation_id))
+
+    async def get_sidebar(self, user_id) -> Optional[List[dict]]:
+        raw = await self.redis.lrange(f"sidebar:{user_id}", 0, -1)
+        return [json.loads(x) for x in raw] if raw else None
+
+    async def set_sidebar(self, user_id, conversations: List[dict], ttl: int = 3600) -> None:
+        key = f"sidebar:{user_id}"
+        if not conversations:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.rpush(key, *[json.dumps(c) for c in conversations])
+        pipe.expire(key, ttl)
+        await pipe.execute()
+
+    async def get_sidebar_version(self, user_id, ttl: int = VERSION_TTL) -> int:
+        """Counter bumped on every sidebar change, for ETag validation"""
+        return await self._get_version(f"sidebar:ver:{user_id}", ttl)
+
+    async def bump_sidebar_version(self, user_id, ttl: int = VERSION_TTL) -> None:
+        pipe = self.redis.pipeline(transaction=True)
+        self._bump_version(pipe, f"sidebar:ver:{user_id}", ttl)
+        await pipe.execute()
+
+    async def add_to_sidebar(self, user_id, conversation: dict, max_len: int = 100) -> None:
+        key = f"sidebar:{user_id}"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lpushx(key, json.dumps(conversation))
+        pipe.ltrim(key, 0, max_len - 1)
+        await pipe.execute()
+        await self.bump_sidebar_version(user_id)
+
+    async def touch_sidebar(self, user_id, conversation_id, ttl: int = 3600, title: Optional[str] = None) -> None:
+        """Move a conversation to the top of the cached sidebar with a fresh updated_at (and title)"""
+        try:
+            await self._touch_sidebar(user_id, conversation_id, ttl, title)
+        finally:
+            # after the write, so a reader never pairs the new version with old data
+            await self.bump_sidebar_version(user_id)
+
+    async def _touch_sidebar(self, user_id, conversation_id, ttl, title) -> None:
+        key = f"sidebar:{user_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                entries = [json.loads(x) for x in await pipe.lrange(key, 0, -1)]
+                if not entries:
+                    return
+                current = next((c for c in entries if c["id"] == str(conversation_id)), None)
+                if current is None:
+                    await self.redis.delete(key)
+                    return
+                rest = [c for c in entries if c is not current]
+                current = current | {"updated_at": datetime.now(timezone.utc).isoformat()}
+                if title is not None:
+                    current["title"] = title
+
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *[json.dumps(c) for c in [current] + rest])
+                pipe.expire(key, ttl)
+                await pipe.execute()
+            except WatchError:
+                # concurrent writer; let the next read refill from Postgres
+                await self.redis.delete(key)
+
+    async def invalidate_sidebar(self, user_id) -> None:
+        await self.redis.delete(f"sidebar:{user_id}")
+        await self.bump_sidebar_version(user_id)
+
+    # ----------------------------
+    # VERSION COUNTERS
+    # ----------------------------
+
+    # Counters are seeded from the clock, so one that expired or was evicted
+    # never repeats an old version (and an old ETag never matches again).
+
+    async def _get_version(self, key, ttl) -> int:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.set(key, time.time_ns() // 1000, nx=True, ex=ttl)
+        pipe.get(key)
+        _, version = await pipe.execute()
+        return int(version)
+
+    def _bump_version(self, pipe, key, ttl = VERSION_TTL) -> None:
+        pipe.set(key, time.time_ns() // 1000, nx=True)
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+
     # ---------------------------------------------------
     # old code
     # ---------------------------------------------------
-    # async def store_message(self, session_id: str, role: str, content: str, ttl: int = 600) -> None:
-    #     history_key = f"chat:{session_id}"
-    #     entry = json.dumps({
-    #         "role": role,
-    #         "content": content,
-    #         "ts": datetime.now(timezone.utc).isoformat()
-    #     })
-    #     # [KEEP] list append + sliding TTL
-    #     await self.redis.rpush(history_key, entry)
-    #     await self.redis.expire(history_key, ttl)
-
-    # async def get_history(self, session_id: str) -> List[dict]:
-    #     history_key = f"chat:{session_id}"
-    #     raw = await self.redis.lrange(history_key, 0, -1)
-    #     return [json.loads(x) for x in raw]
-
     # async def list_sessions_for_user(self, user_id: str) -> List[str]:
     #     """
     #     v1 tracked `user:{user_id}:sessions` via a set; v2 doesn't.
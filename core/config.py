@@ -17,3 +17,104 @@ SESSION_TTL = int(os.getenv("SESSION_TTL", "600"))  # 10 minutes
 
 # App Configuration
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:8000")
+
+# Streaming Configuration
+STREAM_FRAME_INTERVAL_MS = int(os.getenv("STREAM_FRAME_INTERVAL_MS", "50"))  # min time between UI frames
+STREAM_FRAME_MAX_CHARS = int(os.getenv("STREAM_FRAME_MAX_CHARS", "64"))  # flush early once this many chars are buffered
+STREAM_FRAME_MAX_INTERVAL_MS = int(os.getenv("STREAM_FRAME_MAX_INTERVAL_MS", "500"))  # backpressure ceiling
+
+# Reply Persistence Configuration
+REPLY_CHECKPOINT_INTERVAL_MS = int(os.getenv("REPLY_CHECKPOINT_INTERVAL_MS", "1000"))  # partial reply -> Redis
+REPLY_CHECKPOINT_TTL = int(os.getenv("REPLY_CHECKPOINT_TTL", "600"))
+
+# Conversation Cache Configuration
+CONVERSATION_CACHE_TTL = int(os.getenv("CONVERSATION_CACHE_TTL", "3600"))  # 1 hour
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "200"))  # last N messages per conversation
+SIDEBAR_LIMIT = int(os.getenv("SIDEBAR_LIMIT", "100"))
+
+# Archive Configuration
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))  # inactivity before moving to cold storage
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))  # 0 = keep archives forever
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+
+# Classifier Configuration
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "MoritzLaurer/deberta-v3-large-zeroshot-v2.0")
+CLASSIFIER_DEVICE = os.getenv("CLASSIFIER_DEVICE", "cpu")
+CLASSIFIER_SOCKET = os.getenv("CLASSIFIER_SOCKET", "")  # Unix socket of the shared classifier worker; empty = in-process
+CLASSIFIER_WORKERS = int(os.getenv("CLASSIFIER_WORKERS", "2"))  # worker processes in the classifier sidecar
+CLASSIFIER_INTRA_OP_THREADS = int(os.getenv("CLASSIFIER_INTRA_OP_THREADS", "2"))  # torch threads per worker
+CLASSIFIER_STAGED = os.getenv("CLASSIFIER_STAGED", "0") == "1"  # coarse group first, then refine with early exit
+CLASSIFIER_EARLY_EXIT_MARGIN = float(os.getenv("CLASSIFIER_EARLY_EXIT_MARGIN", "0.3"))
+CLASSIFIER_REFINE_BATCH = int(os.getenv("CLASSIFIER_REFINE_BATCH", "2"))  # labels scored per second-stage pass
+
+# Conversation Classification Reuse
+CLASSIFICATION_REUSE_TURNS = int(os.getenv("CLASSIFICATION_REUSE_TURNS", "5"))  # follow-ups before re-running the model
+CLASSIFICATION_STATE_TTL = int(os.getenv("CLASSIFICATION_STATE_TTL", "1800"))  # 30 minutes
+
+# Escalation Configuration
+ESCALATION_WINDOW_SECONDS = int(os.getenv("ESCALATION_WINDOW_SECONDS", "300"))  # one ticket per user per window
+
+# Password Hashing Configuration
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))  # concurrent hash/verify operations
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+# Auth Rate Limiting (sliding window)
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+LOGIN_LIMIT_PER_IP = int(os.getenv("LOGIN_LIMIT_PER_IP", "20"))
+LOGIN_LIMIT_PER_EMAIL = int(os.getenv("LOGIN_LIMIT_PER_EMAIL", "5"))
+REGISTER_LIMIT_PER_IP = int(os.getenv("REGISTER_LIMIT_PER_IP", "5"))
+UNKNOWN_EMAIL_TTL = int(os.getenv("UNKNOWN_EMAIL_TTL", "60"))  # negative cache for logins to unknown emails
+
+# Chat Admission Control
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "8"))  # replies generated at once per worker
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "32"))  # waiting replies before rejecting
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# Reply Streams (any worker generates, any worker relays)
+REPLY_WORKER = os.getenv("REPLY_WORKER", "1") == "1"  # consume generation jobs in this process
+REPLY_STREAM_TTL = int(os.getenv("REPLY_STREAM_TTL", "600"))
+REPLY_RELAY_TIMEOUT_SECONDS = int(os.getenv("REPLY_RELAY_TIMEOUT_SECONDS", "60"))  # give up if a reply stalls
+REPLY_JOB_CLAIM_IDLE_MS = int(os.getenv("REPLY_JOB_CLAIM_IDLE_MS", "120000"))  # retake jobs from dead workers
+REPLY_MAX_BACKLOG = int(os.getenv("REPLY_MAX_BACKLOG", "200"))  # queued jobs across all workers before rejecting
+REPLY_PREFETCH = int(os.getenv("REPLY_PREFETCH", "8"))  # jobs claimed beyond free slots, for admission to reorder
+
+# Kafka Configuration
+KAFKA_BOOTSTRAP = os.getenv("KAFKA_BOOTSTRAP", "localhost:9092")
+TICKETS_TOPIC = os.getenv("TICKETS_TOPIC", "support-tickets")
+MESSAGES_TOPIC = os.getenv("MESSAGES_TOPIC", "support-messages")  # every classified message, for analytics
+ANALYTICS_GROUP = os.getenv("ANALYTICS_GROUP", "ticket-analytics")
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "500"))
+ANALYTICS_POLL_MS = int(os.getenv("ANALYTICS_POLL_MS", "1000"))
+
+# Export / Import Configuration
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "1000"))  # rows per server-side cursor fetch
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))  # messages per COPY
+
+# Search Configuration
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")  # Postgres text search configuration
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+
+# Knowledge Base Configuration
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", "kb_index")
+KB_EMBEDDING_MODEL = os.getenv("KB_EMBEDDING_MODEL", "text-embedding-3-small")
+KB_CHUNK_TOKENS = int(os.getenv("KB_CHUNK_TOKENS", "300"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "4"))  # candidates considered per message
+KB_TOKEN_BUDGET = int(os.getenv("KB_TOKEN_BUDGET", "1200"))  # max snippet tokens injected into the prompt
+KB_MIN_SCORE = float(os.getenv("KB_MIN_SCORE", "0.3"))  # cosine similarity floor
+
+# Tenant Configuration
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")  # JSON tenant registry; empty = single default tenant
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")  # used for hosts not claimed by any tenant
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+
+# Shutdown Configuration
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "25"))  # drain deadline before pools close
+
+# Migration Configuration
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")  # give up instead of queueing behind long transactions
+
+# Proxy Configuration
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")  # IPs/CIDRs whose X-Forwarded-* headers are believed
@@ -1,23 +1,40 @@
 import asyncpg
 from redis.asyncio import Redis
 from core.cache import ChatCache
-from core.config import PG_DSN, REDIS_HOST, REDIS_PORT, REDIS_USERNAME, REDIS_PASSWORD
+from core.archive import ensure_hot
+from core.metrics import span, log_db_query
+from core.config import (
+    PG_DSN, REDIS_HOST, REDIS_PORT, REDIS_USERNAME, REDIS_PASSWORD,
+    CONVERSATION_CACHE_TTL, HISTORY_CACHE_SIZE, SIDEBAR_LIMIT, DEFAULT_TENANT,
+)
 
 # =============================================================================
 # CONNECTION SETUP
 # =============================================================================
 
+async def instrument_connection(conn):
+    """Time every query on new pool connections"""
+    conn.add_query_logger(log_db_query)
+
 async def create_database_pool():
     """Create PostgreSQL connection pool"""
     return await asyncpg.create_pool(
         dsn=PG_DSN,
         min_size=1,
         max_size=10,
+        init=instrument_connection,
     )
 
+class InstrumentedRedis(Redis):
+    """Redis client that times every command"""
+
+    async def execute_command(self, *args, **options):
+        with span("redis", command=str(args[0])):
+            return await super().execute_command(*args, **options)
+
 async def create_redis_client():
     """Create Redis client"""
-    redis = Redis(
+    redis = InstrumentedRedis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         username=REDIS_USERNAME,
@@ -44,8 +61,8 @@ async def db_insert_async(pool, ticket: dict):
         async with pool.acquire() as conn:
             result = await conn.fetchrow(
                 """
-                INSERT INTO tickets (user_id, message, label, confidence, escalated)
-                VALUES ($1, $2, $3, $4, $5)
+                INSERT INTO tickets (user_id, message, label, confidence, escalated, tenant)
+                VALUES ($1, $2, $3, $4, $5, $6)
                 RETURNING id, created_at;
                 """,
                 ticket.get("userId"),
@@ -53,8 +70,97 @@ async def db_insert_async(pool, ticket: dict):
                 ticket.get("label"),
                 ticket.get("confidence"),
                 ticket.get("escalated", False),
+                ticket.get("tenant") or DEFAULT_TENANT,
             )
             return result
     except Exception as e:
         print(f"Database insert error: {e}")
-        raise
\ No newline at end of file
+        raise
+
+async def db_insert_message_async(pool, conversation_id, role, content):
+    """Insert a message and bump the conversation in one transaction"""
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await ensure_hot(conn, conversation_id)
+                await conn.execute(
+                    """
+                    INSERT INTO messages (conversation_id, role, content)
+                    VALUES ($1, $2, $3)
+                    """,
+                    conversation_id, role, content,
+                )
+                await conn.execute(
+                    "UPDATE conversations SET updated_at=now() WHERE id=$1",
+                    conversation_id,
+                )
+    except Exception as e:
+        print(f"Database insert error: {e}")
+        raise
+
+async def get_current_conversation(pool, cache, user_id):
+    """The user's last active conversation id (None before bootstrap), served from Redis when hot"""
+    cached = await cache.get_active_conversation(user_id)
+    if cached:
+        return cached
+
+    async with pool.acquire() as conn:
+        current = await conn.fetchval(
+            "SELECT last_active_conversation_id::text FROM users WHERE id=$1",
+            user_id,
+        )
+    if current:
+        await cache.set_active_conversation(user_id, current, ttl=CONVERSATION_CACHE_TTL)
+    return current
+
+async def get_sidebar(pool, cache, user_id):
+    """Most recently updated conversations for a user, served from Redis when hot"""
+    cached = await cache.get_sidebar(user_id)
+    if cached is not None:
+        return cached
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id::text, COALESCE(title,'') AS title, updated_at
+            FROM conversations
+            WHERE user_id=$1
+            ORDER BY updated_at DESC
+            LIMIT $2
+            """,
+            user_id, SIDEBAR_LIMIT,
+        )
+    conversations = [
+        {"id": r["id"], "title": r["title"], "updated_at": r["updated_at"].isoformat()}
+        for r in rows
+    ]
+    await cache.set_sidebar(user_id, conversations, ttl=CONVERSATION_CACHE_TTL)
+    return conversations
+
+async def get_recent_messages(pool, cache, conversation_id):
+    """Last HISTORY_CACHE_SIZE messages of a conversation, served from Redis when hot"""
+    cached = await cache.get_history(conversation_id)
+    if cached is not None:
+        return cached
+
+    # Version before data, so a message stored during the read keeps the stale result out of the cache
+    version = await cache.get_history_version(conversation_id)
+    async with pool.acquire() as conn:
+        # Inactive conversations live in cold storage until accessed again
+        await ensure_hot(conn, conversation_id)
+        rows = await conn.fetch(
+            """
+            SELECT role, content FROM (
+                SELECT id, role, content
+                FROM messages
+                WHERE conversation_id=$1
+                ORDER BY id DESC
+                LIMIT $2
+            ) recent
+            ORDER BY id ASC
+            """,
+            conversation_id, HISTORY_CACHE_SIZE,
+        )
+        messages = [{"role": r["role"], "content": r["content"]} for r in rows]
+    await cache.set_history(conversation_id, messages, version, ttl=CONVERSATION_CACHE_TTL)
+    return messages
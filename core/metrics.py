@@ -0,0 +1,57 @@
+"""Request-path tracing and Prometheus metrics"""
+import time
+from contextlib import contextmanager, nullcontext
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("chatbot_netsia")
+except ImportError:  # spans are still timed into Prometheus without OpenTelemetry
+    tracer = None
+
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_seconds",
+    "Time spent per request-path stage",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STAGE_ERRORS = Counter("chatbot_stage_errors_total", "Failed request-path stages", ["stage"])
+DB_POOL_CONNECTIONS = Gauge("chatbot_db_pool_connections", "Postgres pool connections", ["state"])
+INFLIGHT_REPLIES = Gauge("chatbot_inflight_replies", "Assistant replies currently being generated")
+ADMISSION_ACTIVE = Gauge("chatbot_admission_active", "Chat replies admitted and running")
+ADMISSION_QUEUED = Gauge("chatbot_admission_queued", "Chat replies waiting for admission")
+ADMISSION_REJECTED = Counter("chatbot_admission_rejected_total", "Chat replies rejected as busy", ["reason"])
+PASSWORD_HASH_PENDING = Gauge("chatbot_password_hash_pending", "Password hash/verify jobs queued or running")
+
+@contextmanager
+def span(stage: str, **attributes):
+    """Time a block as one stage, and open an OpenTelemetry span for it when available"""
+    start = time.perf_counter()
+    otel_span = tracer.start_as_current_span(stage, attributes=attributes) if tracer else nullcontext()
+    with otel_span:
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.labels(stage).inc()
+            raise
+        finally:
+            STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def observe(stage: str, seconds: float):
+    """Record a stage duration measured elsewhere (e.g. time to first token)"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+def track_pool(pool):
+    """Expose asyncpg pool occupancy as gauges"""
+    DB_POOL_CONNECTIONS.labels("total").set_function(pool.get_size)
+    DB_POOL_CONNECTIONS.labels("idle").set_function(pool.get_idle_size)
+    DB_POOL_CONNECTIONS.labels("max").set_function(pool.get_max_size)
+
+def log_db_query(record):
+    """asyncpg query logger: one observation per executed query"""
+    observe("db_query", record.elapsed)
+    if record.exception is not None:
+        STAGE_ERRORS.labels("db_query").inc()
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
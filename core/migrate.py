@@ -0,0 +1,157 @@
+"""
+Schema migrations.
+
+Run once per deploy, before starting the new version, instead of from
+every worker's startup:
+
+    python -m core.migrate
+
+Every step is idempotent and checks the catalog before touching a table,
+so a re-run takes no locks. Steps that do need ACCESS EXCLUSIVE (adding
+the generated search columns rewrites the table the first time) give up
+after MIGRATION_LOCK_TIMEOUT instead of queueing behind long readers and
+stalling traffic; re-run them when the table is quiet. Indexes are built
+CONCURRENTLY.
+"""
+import asyncio
+import asyncpg
+from core.config import PG_DSN, MIGRATION_LOCK_TIMEOUT, DEFAULT_TENANT
+from core.search import SEARCH_CONFIG
+
+def quote(value):
+    """SQL string literal, for DDL that can't take parameters"""
+    return "'" + value.replace("'", "''") + "'"
+
+async def column_exists(conn, table, column):
+    return await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name=$1 AND column_name=$2
+        )
+        """,
+        table, column,
+    )
+
+async def create_index_concurrently(conn, name, definition):
+    """CREATE INDEX CONCURRENTLY, replacing an invalid index left by an interrupted build"""
+    valid = await conn.fetchval(
+        """
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname=$1 AND c.relnamespace = current_schema()::regnamespace
+        """,
+        name,
+    )
+    if valid:
+        return
+    if valid is False:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    print(f"Building index {name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
+
+async def add_generated_column(conn, table, column, expression):
+    if await column_exists(conn, table, column):
+        return
+    print(f"Adding {table}.{column} (rewrites the table)")
+    await conn.execute(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} tsvector GENERATED ALWAYS AS ({expression}) STORED"
+    )
+
+# =============================================================================
+# MIGRATIONS
+# =============================================================================
+
+async def archive_schema(conn):
+    """Cold storage for inactive conversations (core.archive)"""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_archives (
+            conversation_id UUID PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+            message_count INTEGER NOT NULL,
+            payload BYTEA NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+async def search_schema(conn):
+    """
+    tsvector columns and GIN indexes for full-text search (core.search).
+
+    The columns are generated, so Postgres fills them in on every insert
+    (add_message, assistant replies, rehydration, COPY imports) and on
+    title changes.
+    """
+    await add_generated_column(
+        conn, "messages", "search_vector", f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))"
+    )
+    await add_generated_column(
+        conn, "conversations", "title_vector", f"to_tsvector('{SEARCH_CONFIG}', coalesce(title, ''))"
+    )
+    await create_index_concurrently(conn, "messages_search_idx", "messages USING GIN (search_vector)")
+    await create_index_concurrently(
+        conn, "conversations_title_search_idx", "conversations USING GIN (title_vector)"
+    )
+
+async def user_email_index(conn):
+    """Case-insensitive email lookups (api.auth.utils.get_user_by_email)"""
+    await create_index_concurrently(conn, "users_email_lower_idx", "users (lower(email))")
+
+async def ticket_tenant(conn):
+    """Tenant of each ticket; rows from before multi-tenancy belong to DEFAULT_TENANT"""
+    if await column_exists(conn, "tickets", "tenant"):
+        return
+    # a constant default is stored in the catalog, so this doesn't rewrite the table
+    await conn.execute(
+        f"ALTER TABLE tickets ADD COLUMN IF NOT EXISTS tenant TEXT NOT NULL DEFAULT {quote(DEFAULT_TENANT)}"
+    )
+
+async def analytics_schema(conn):
+    """Hourly per-tenant, per-label counts and consumed offsets (services.ticket_analytics)"""
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ticket_stats_hourly (
+            tenant TEXT NOT NULL,
+            hour TIMESTAMPTZ NOT NULL,
+            label TEXT NOT NULL,
+            messages BIGINT NOT NULL DEFAULT 0,
+            escalations BIGINT NOT NULL DEFAULT 0,
+            escalation_rate REAL GENERATED ALWAYS AS (
+                CASE WHEN messages > 0 THEN escalations::real / messages END
+            ) STORED,
+            PRIMARY KEY (tenant, hour, label)
+        );
+        CREATE TABLE IF NOT EXISTS analytics_offsets (
+            consumer_group TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            partition INTEGER NOT NULL,
+            next_offset BIGINT NOT NULL,
+            PRIMARY KEY (consumer_group, topic, partition)
+        );
+        """
+    )
+    if not await column_exists(conn, "ticket_stats_hourly", "tenant"):
+        # Tables created before tenants were counted: existing counts go to the default tenant
+        async with conn.transaction():
+            await conn.execute(
+                f"ALTER TABLE ticket_stats_hourly ADD COLUMN tenant TEXT NOT NULL DEFAULT {quote(DEFAULT_TENANT)}"
+            )
+            await conn.execute("ALTER TABLE ticket_stats_hourly ALTER COLUMN tenant DROP DEFAULT")
+            await conn.execute("ALTER TABLE ticket_stats_hourly DROP CONSTRAINT ticket_stats_hourly_pkey")
+            await conn.execute("ALTER TABLE ticket_stats_hourly ADD PRIMARY KEY (tenant, hour, label)")
+
+MIGRATIONS = [archive_schema, search_schema, user_email_index, ticket_tenant, analytics_schema]
+
+async def migrate(dsn=PG_DSN):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        for step in MIGRATIONS:
+            await step(conn)
+        print("Schema is up to date")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
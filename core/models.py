@@ -13,6 +13,9 @@ class LoginIn(BaseModel):
 class ConversationCreate(BaseModel):
     title: str
 
+class ReplyIn(BaseModel):
+    content: str  # the user message to answer; already saved via POST /messages
+
 class MessageIn(BaseModel):
     role: str    # 'user' or 'assistant' or 'system' (or 'tool'?)
     content: str
\ No newline at end of file
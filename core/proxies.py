@@ -0,0 +1,41 @@
+"""Client details for requests arriving through trusted reverse proxies"""
+import ipaddress
+from core.config import TRUSTED_PROXIES
+
+_trusted = [ipaddress.ip_network(p.strip(), strict=False) for p in TRUSTED_PROXIES.split(",") if p.strip()]
+
+def is_trusted_proxy(addr):
+    try:
+        ip = ipaddress.ip_address(addr)
+    except (TypeError, ValueError):
+        return False
+    return any(ip in net for net in _trusted)
+
+def peer_address(request):
+    return request.client.host if request.client else None
+
+def client_ip(request):
+    """
+    The client's address: the peer itself unless it is a trusted proxy,
+    otherwise the last X-Forwarded-For hop not added by a trusted proxy.
+    Hops further left are client-supplied and ignored.
+    """
+    addr = peer_address(request)
+    if not is_trusted_proxy(addr):
+        return addr or "unknown"
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        addr = hop
+        if not is_trusted_proxy(hop):
+            break
+    return addr
+
+def request_host(request):
+    """
+    The host the client asked for. X-Forwarded-Host is only believed from a
+    trusted proxy (including the UI's loopback calls to the API); anyone
+    else gets their Host header, which the proxy in front sets.
+    """
+    if is_trusted_proxy(peer_address(request)):
+        return request.headers.get("x-forwarded-host") or request.headers.get("host")
+    return request.headers.get("host")
@@ -0,0 +1,56 @@
+"""Full-text search over conversation titles and message content"""
+import re
+from core.config import SEARCH_CONFIG
+
+if not re.fullmatch(r"[a-z_]+", SEARCH_CONFIG):
+    raise ValueError(f"Invalid SEARCH_CONFIG: {SEARCH_CONFIG!r}")
+
+HIGHLIGHT_OPTIONS = "StartSel=**, StopSel=**, MaxWords=24, MinWords=8, MaxFragments=2, FragmentDelimiter=\" … \""
+
+# =============================================================================
+# QUERY
+# =============================================================================
+
+async def search_conversations(pool, user_id, query, limit=20, offset=0):
+    """
+    Ranked title and message matches for a user's conversations.
+
+    `query` uses web-search syntax ("quoted phrases", or, -excluded).
+    Snippets mark matched words with **bold**; only the returned page is
+    highlighted. Archived conversations match on title only.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            WITH q AS (SELECT websearch_to_tsquery('{SEARCH_CONFIG}', $2) AS query),
+            hits AS (
+                SELECT c.id AS conversation_id, c.title, 'title' AS kind, c.title AS content,
+                       c.updated_at, ts_rank(c.title_vector, q.query) * 2 AS rank
+                FROM conversations c, q
+                WHERE c.user_id=$1 AND c.title_vector @@ q.query
+                UNION ALL
+                SELECT c.id, c.title, m.role, m.content,
+                       c.updated_at, ts_rank(m.search_vector, q.query)
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id, q
+                WHERE c.user_id=$1 AND m.search_vector @@ q.query
+                ORDER BY rank DESC, updated_at DESC
+                LIMIT $3 OFFSET $4
+            )
+            SELECT hits.conversation_id::text, COALESCE(hits.title,'') AS title, hits.kind, hits.rank,
+                   ts_headline('{SEARCH_CONFIG}', hits.content, q.query, '{HIGHLIGHT_OPTIONS}') AS snippet
+            FROM hits, q
+            ORDER BY hits.rank DESC, hits.updated_at DESC
+            """,
+            user_id, query, limit, offset,
+        )
+    return [
+        {
+            "conversation_id": r["conversation_id"],
+            "title": r["title"],
+            "kind": r["kind"],
+            "snippet": r["snippet"],
+            "rank": r["rank"],
+        }
+        for r in rows
+    ]
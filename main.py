@@ -1,13 +1,23 @@
 """Main FastAPI application"""
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 from contextlib import asynccontextmanager
+import asyncio
+import time
 import gradio as gr
 
 # Import modules
 from core.database import create_database_pool, create_redis_client, create_cache
+from core.archive import run_archiver
+from core.metrics import track_pool, render_metrics
+from core.config import CLASSIFIER_SOCKET, REPLY_WORKER, SHUTDOWN_TIMEOUT_SECONDS
+from services.classifier import get_classifier
+from services.chatbot import run_reply_worker, close_producer
+from services.admission import admission
+from services.supervisor import supervisor
 from api.auth.auth_routes import router as auth_router
 from api.conversations.conversation_routes import router as conversations_router
+from api.conversations.export_routes import router as export_router
 from ui.login import create_login_page
 from ui.register import create_register_page
 from ui.chat import create_chat_page
@@ -20,11 +30,34 @@ async def lifespan(app: FastAPI):
     app.state.redis = redis
     app.state.cache = create_cache(redis)
     app.state.pool = await create_database_pool()
+    track_pool(app.state.pool)
+    if REPLY_WORKER and not CLASSIFIER_SOCKET:
+        await asyncio.to_thread(get_classifier)  # load the in-process model before serving
+    archiver = asyncio.create_task(run_archiver(app.state.pool, app.state.cache))
+    stop = asyncio.Event()
+    reply_worker = asyncio.create_task(
+        run_reply_worker(app.state.pool, app.state.cache, stop=stop)
+    ) if REPLY_WORKER else None
 
     try:
         yield  # App runs here
     finally:
-        # Shutdown
+        # Shutdown. The server has stopped accepting connections and waited
+        # (up to its graceful timeout) for open requests and streams; what is
+        # left here is background work. Stop taking new work, let in-flight
+        # replies and Kafka sends finish by the deadline, then close the pools.
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+        stop.set()
+        admission.close()
+        if reply_worker:
+            await asyncio.wait([reply_worker], timeout=max(0, deadline - time.monotonic()))
+            reply_worker.cancel()
+        cancelled = await supervisor.drain(deadline)
+        if cancelled:
+            print(f"Shutdown deadline reached; cancelled {cancelled} background task(s)")
+        archiver.cancel()
+        await asyncio.gather(archiver, return_exceptions=True)
+        await close_producer()
         await redis.close()
         await app.state.pool.close()
 
@@ -33,6 +66,7 @@ app = FastAPI(lifespan=lifespan)
 
 # Include routers
 app.include_router(auth_router)
+app.include_router(export_router)
 app.include_router(conversations_router)
 
 # Create UI pages
@@ -48,4 +82,10 @@ app = gr.mount_gradio_app(app, chat_page, path="/chat")
 @app.get("/")
 async def root():
     """Redirect root to login"""
-    return RedirectResponse(url="/login", status_code=307)
\ No newline at end of file
+    return RedirectResponse(url="/login", status_code=307)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
\ No newline at end of file
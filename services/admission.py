@@ -0,0 +1,103 @@
+"""Admission control for chat generation"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from core.config import CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT_SECONDS
+from core.metrics import observe, ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_REJECTED
+
+# Lower runs first
+PRIORITY_ONGOING = 0
+PRIORITY_NEW = 1
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted within its deadline"""
+
+class ShuttingDown(Overloaded):
+    """Raised for new and still-queued requests once admission is closed"""
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queue, timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self.closed = False
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.set(self.active)
+        ADMISSION_QUEUED.set(len(self._waiters))
+
+    async def acquire(self, priority=PRIORITY_NEW, timeout=None):
+        if self.closed:
+            ADMISSION_REJECTED.labels("shutdown").inc()
+            raise ShuttingDown("shutting down")
+
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._update_gauges()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            raise Overloaded("queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self._update_gauges()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                if future.exception() is not None:
+                    raise future.exception()  # closed as we gave up; already dequeued
+                # the slot was handed over as we gave up; pass it on
+                self.release()
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            self._update_gauges()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            ADMISSION_REJECTED.labels("timeout").inc()
+            raise Overloaded("timed out waiting for a slot")
+        finally:
+            observe("admission_wait", time.perf_counter() - start)
+
+    def release(self):
+        # hand the slot straight to the best waiter, keeping `active` unchanged
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                self._update_gauges()
+                return
+        self.active -= 1
+        self._update_gauges()
+
+    def close(self):
+        """Stop admitting for shutdown: queued and new requests get ShuttingDown, admitted ones finish"""
+        self.closed = True
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                ADMISSION_REJECTED.labels("shutdown").inc()
+                future.set_exception(ShuttingDown("shutting down"))
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_NEW):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+admission = AdmissionController(CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT_SECONDS)
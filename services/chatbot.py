@@ -1,15 +1,26 @@
 import os
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from services.classifier import classify
+from services.classifier import classify_async, is_followup, is_confident
+from services.admission import admission, Overloaded, ShuttingDown, PRIORITY_ONGOING, PRIORITY_NEW
+from services.knowledge_base import knowledge_context
+from services.tenants import get_tenant
+from services.supervisor import supervisor
 from datetime import datetime, timezone
 from aiokafka import AIOKafkaProducer
-import json, asyncio
-from core.database import db_insert_async
+import json, asyncio, re, socket
+from core.database import db_insert_async, db_insert_message_async, get_recent_messages
+from core.config import (
+    REPLY_CHECKPOINT_INTERVAL_MS, REPLY_CHECKPOINT_TTL, CONVERSATION_CACHE_TTL, HISTORY_CACHE_SIZE,
+    CLASSIFICATION_STATE_TTL, ESCALATION_WINDOW_SECONDS,
+    REPLY_STREAM_TTL, REPLY_RELAY_TIMEOUT_SECONDS, REPLY_JOB_CLAIM_IDLE_MS, REPLY_MAX_BACKLOG, REPLY_PREFETCH,
+    CHAT_QUEUE_TIMEOUT_SECONDS, KAFKA_BOOTSTRAP, TICKETS_TOPIC, MESSAGES_TOPIC, CHAT_MODEL,
+)
 import time
+from core.metrics import span, observe, INFLIGHT_REPLIES, ADMISSION_REJECTED
 
-BOOTSTRAP = "localhost:9092"
-TOPIC = "support-tickets"
+BOOTSTRAP = KAFKA_BOOTSTRAP
+TOPIC = TICKETS_TOPIC
 
 load_dotenv(override=True)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
@@ -48,52 +59,139 @@ escalate_function = {
 
 functions = [escalate_function]
 
-async def escalate(ticket):
-    producer = AIOKafkaProducer(bootstrap_servers=BOOTSTRAP)
-    await producer.start()
+BUSY_MESSAGE = (
+    "We're handling an unusually high number of requests right now. "
+    "Please try again in a moment."
+)
+
+# Appended to the saved partial text of a reply that failed mid-stream
+INTERRUPTED_NOTE = "\n\n_(This reply was interrupted. Please ask again.)_"
+
+# Explicit requests for a human, handled without the LLM decision pass. Only
+# messages that are nothing but the request match ("agent", "talk to a human
+# please", "escalate my ticket"); mentions inside other questions go to the LLM.
+_HUMAN = r"(a\s+|an\s+|the\s+)?((real|live)\s+)?(human|person|agent|representative|operator|manager|supervisor|someone)"
+ESCALATION_INTENT = re.compile(
+    r"^\W*(please\s+)?("
+    r"(human|agent|representative|operator|supervisor|manager)"
+    r"|((i\s+(want|need|would\s+like)\s+to|(can|could|may)\s+i|let\s+me)\s+)?(talk|speak|chat)\s+(to|with)\s+" + _HUMAN
+    + r"|(i\s+(want|need)|get\s+me|give\s+me|connect\s+me\s+(to|with))\s+" + _HUMAN
+    + r"|escalate(\s+(this|it|my\s+(ticket|issue|case|problem)))?"
+    r")(\s+(now|please))*\W*$",
+    re.IGNORECASE,
+)
+NEGATION = re.compile(r"\b(don['’]?t|do\s+not|no\s+need|not|never)\b", re.IGNORECASE)
+
+def is_escalation_request(text):
+    return bool(ESCALATION_INTENT.match(text)) and not NEGATION.search(text)
+
+_producers = {}
+_producer_lock = asyncio.Lock()
+
+async def get_producer(bootstrap=BOOTSTRAP):
+    """Kafka producer shared by every tenant on the same cluster, started on first use"""
+    async with _producer_lock:
+        if bootstrap not in _producers:
+            producer = AIOKafkaProducer(bootstrap_servers=bootstrap)
+            await producer.start()
+            _producers[bootstrap] = producer
+    return _producers[bootstrap]
+
+async def close_producer():
+    while _producers:
+        _, producer = _producers.popitem()
+        await producer.stop()  # flushes pending sends
+
+async def publish(topic, payload, key, bootstrap=BOOTSTRAP):
+    with span("kafka_send", topic=topic):
+        producer = await get_producer(bootstrap)
+        await producer.send_and_wait(topic, json.dumps(payload, default=str).encode(), key=key.encode())
+
+async def escalate(ticket, tenant=None):
+    tenant = tenant or get_tenant()
+    await publish(tenant.tickets_topic, ticket, ticket["userId"], bootstrap=tenant.kafka_bootstrap)
+    print("ticket sent")
+
+async def publish_message_event(ticket):
     try:
-        await producer.send_and_wait(
-            TOPIC,
-            json.dumps(ticket).encode(),
-            key=ticket["userId"].encode()
-        )
-        print("ticket sent")
-    finally:
-        await producer.stop()
+        await publish(MESSAGES_TOPIC, ticket, ticket["userId"])
+    except Exception as e:
+        print(f"Message event publish failed: {e}")
+
+def record_escalated_message(user_id, text, label, confidence, reason, tenant):
+    """Message event for a message answered by an escalation short-circuit, so it counts towards rates"""
+    event = {
+        "userId": user_id,
+        "tenant": tenant.id,
+        "message": text,
+        "label": label,
+        "confidence": confidence,
+        "escalated": True,
+        "reason": reason,
+        "ts": datetime.now(timezone.utc).isoformat(),
+    }
+    supervisor.spawn(publish_message_event(event), name=f"message-event-{user_id}")
+
+async def escalate_and_record(pool, user_id, user_message, reason, cache=None, label=None, confidence=None, tenant=None):
+    """
+    Create an escalation ticket and publish it to Kafka.
+
+    With a cache, only one ticket per user is created within
+    ESCALATION_WINDOW_SECONDS; later calls in the window return the
+    existing ticket instead.
+
+    Returns:
+        (message for the user, whether this was a duplicate)
+    """
+    if cache is not None and not await cache.claim_escalation(user_id, ttl=ESCALATION_WINDOW_SECONDS):
+        existing = await cache.get_escalation(user_id) or {}
+        return already_escalated_message(existing.get("ticket_id"), existing.get("created_at")), True
 
-async def escalate_and_record(pool, user_id, user_message, reason):
+    tenant = tenant or get_tenant()
     ticket = {
         "userId": user_id,
+        "tenant": tenant.id,
         "message": user_message,
-        "label": None,
-        "confidence": None,
+        "label": label,
+        "confidence": confidence,
         "escalated": True,
         "reason": reason,
         "ts": datetime.now(timezone.utc).isoformat(),
     }
 
-    ticket_id, created_at = await db_insert_async(pool, ticket)
+    try:
+        ticket_id, created_at = await db_insert_async(pool, ticket)
+    except Exception:
+        if cache is not None:
+            await cache.release_escalation(user_id)
+        raise
+    if cache is not None:
+        await cache.record_escalation(user_id, ticket_id, created_at)
 
-    asyncio.create_task(escalate(ticket | {"id": ticket_id}))
+    supervisor.spawn(escalate(ticket | {"id": ticket_id}, tenant), name=f"escalate-{ticket_id}")
 
-    return escalation_message(ticket_id, created_at)
+    return escalation_message(ticket_id, created_at), False
 
-async def call_tool(name, arguments, pool):
+async def call_tool(name, arguments, pool, cache=None, label=None, confidence=None, tenant=None):
     if name == "escalate_ticket":
-        result_message = await escalate_and_record(
+        result_message, duplicate = await escalate_and_record(
             pool,
             arguments["user_id"],
             arguments["user_message"],
             arguments["reason"],
+            cache,
+            label,
+            confidence,
+            tenant,
         )
-        return {"status": "ok", "tool": name, "result": result_message}
+        return {"status": "ok", "tool": name, "result": result_message, "duplicate": duplicate}
     return {"status": "error", "error": f"Unknown tool {name}"}
 
-async def stream_answer(messages):
+async def stream_answer(messages, model=CHAT_MODEL):
     start = time.perf_counter()
 
     stream = await openai.chat.completions.create(
-        model="gpt-4o-mini",
+        model=model,
         messages=messages,
         stream=True,
         temperature=0.3,
@@ -107,17 +205,18 @@ async def stream_answer(messages):
             #resp += delta
             if first_chunk_time is None:
                 first_chunk_time = time.perf_counter()
-                print(f"First token latency: {first_chunk_time - start:.2f} seconds")
+                observe("llm_ttft", first_chunk_time - start)
 
             yield delta
             
-    total = time.perf_counter() - start
-    print(f"Total OpenAI API stream duration: {total:.2f} seconds")
+    observe("llm_stream", time.perf_counter() - start)
 
 
-async def process_user_message(user_id, text, history, pool, label, confidence):
+async def process_user_message(user_id, text, history, pool, label, confidence, cache=None, tenant=None, raw_label=None):
+    tenant = tenant or get_tenant()
     ticket = {
         "userId": user_id,
+        "tenant": tenant.id,
         "message": text,
         "label": label,
         "confidence": confidence,
@@ -125,29 +224,41 @@ async def process_user_message(user_id, text, history, pool, label, confidence):
         "reason": "",
         "ts": datetime.now(timezone.utc).isoformat(),
     }
-    await db_insert_async(pool, ticket)
+    # Retrieval overlaps the ticket insert
+    (ticket_id, _), context = await asyncio.gather(
+        db_insert_async(pool, ticket),
+        knowledge_context(text, raw_label, tenant),
+    )
+    supervisor.spawn(publish_message_event(ticket | {"id": ticket_id}), name=f"message-event-{ticket_id}")
 
-    messages = system_prompt + history + [{"role": "user", "content": text}]
+    prompt = [{"role": "system", "content": tenant.system_prompt}] if tenant.system_prompt else system_prompt
+    messages = prompt + context + history + [{"role": "user", "content": text}]
 
     # Decision pass (no streaming) to see if model wants a tool
-    first = await openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        functions=functions,
-        function_call="auto",
-        temperature=0.3,
-    )
+    with span("llm_decision"):
+        first = await openai.chat.completions.create(
+            model=tenant.model,
+            messages=messages,
+            functions=functions,
+            function_call="auto",
+            temperature=0.3,
+        )
 
     choice = first.choices[0]
     fn_call = getattr(choice.message, "function_call", None)
 
     if fn_call and fn_call.name == "escalate_ticket":
         args = json.loads(fn_call.arguments or "{}")
-        args.setdefault("user_id", user_id)
+        args["user_id"] = user_id  # never trust the model with whose ticket this is
         args.setdefault("user_message", text)
         args.setdefault("reason", "user_requested")
 
-        tool_result = await call_tool(fn_call.name, args, pool)
+        tool_result = await call_tool(fn_call.name, args, pool, cache, label, confidence, tenant)
+
+        # Already escalated in this window: no need to have the model phrase it
+        if tool_result.get("duplicate"):
+            yield tool_result["result"]
+            return
 
         #Append the original assistant message (with function_call) + function result
         followup_messages = (
@@ -160,31 +271,245 @@ async def process_user_message(user_id, text, history, pool, label, confidence):
             }]
         )
 
-        final_resp = await openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=followup_messages,
-            temperature=0.3,
-        )
+        with span("llm_followup"):
+            final_resp = await openai.chat.completions.create(
+                model=tenant.model,
+                messages=followup_messages,
+                temperature=0.3,
+            )
         yield final_resp.choices[0].message.content
         return
     
     # no tool: stream answer
-    async for chunk in stream_answer(messages):
+    async for chunk in stream_answer(messages, tenant.model):
         yield chunk
 
-async def handle_message(user_id, text, history, pool):
+async def classify_in_context(text, cache, conversation_id, tenant=None):
+    """Classify a message, letting follow-ups inherit the conversation's label"""
+    tenant = tenant or get_tenant()
+    if cache is None or conversation_id is None:
+        return await classify_async(text, tenant)
+
+    state = await cache.get_classification(conversation_id)
+    if state and is_followup(text, state["label"], state["turns"], tenant.label_set):
+        await cache.set_classification(
+            conversation_id, state["label"], state["confidence"], state["turns"] + 1,
+            ttl=CLASSIFICATION_STATE_TTL,
+        )
+        return state["label"], state["confidence"]
+
+    raw_label, confidence = await classify_async(text, tenant)
+    if raw_label is not None and is_confident(confidence, tenant.label_set):
+        await cache.set_classification(conversation_id, raw_label, confidence, ttl=CLASSIFICATION_STATE_TTL)
+    return raw_label, confidence
 
-    raw_label, confidence = classify(text)
+async def conversation_label(cache, conversation_id):
+    """The conversation's current label (candidate label text), if one has been classified"""
+    if cache is None or conversation_id is None:
+        return None
+    state = await cache.get_classification(conversation_id)
+    return state["label"] if state else None
+
+async def handle_message(user_id, text, history, pool, cache=None, conversation_id=None, tenant=None):
+    tenant = tenant or get_tenant()
+
+    # Fast path: explicit escalation requests skip classification and both LLM passes;
+    # the ticket carries the label the conversation is already about, if any
+    if is_escalation_request(text):
+        label = normalize_label(await conversation_label(cache, conversation_id))
+        msg, _ = await escalate_and_record(
+            pool, user_id, text, reason="user_requested", cache=cache, label=label, tenant=tenant
+        )
+        record_escalated_message(user_id, text, label, None, "user_requested", tenant)
+        yield msg
+        return
+
+    raw_label, confidence = await classify_in_context(text, cache, conversation_id, tenant)
     label = normalize_label(raw_label)
 
-    if label is None or confidence is None:
-        msg = await escalate_and_record(pool, user_id, text, reason="low_confidence")
+    if label is None or not is_confident(confidence, tenant.label_set):
+        # Below the threshold the classifier's best guess is still recorded
+        msg, _ = await escalate_and_record(
+            pool, user_id, text, reason="low_confidence", cache=cache, label=label, confidence=confidence,
+            tenant=tenant,
+        )
+        record_escalated_message(user_id, text, label, confidence, "low_confidence", tenant)
         yield msg
         return
 
-    async for output in process_user_message(user_id, text, history, pool, label, confidence):
+    async for output in process_user_message(user_id, text, history, pool, label, confidence, cache, tenant, raw_label):
         yield output
 
+async def save_reply(pool, cache, conversation_id, reply):
+    await db_insert_message_async(pool, conversation_id, "assistant", reply)
+    await cache.store_message(
+        conversation_id, "assistant", reply,
+        max_len=HISTORY_CACHE_SIZE, ttl=CONVERSATION_CACHE_TTL,
+    )
+
+async def produce_reply(user_id, text, history, pool, cache, conversation_id, tenant=None):
+    """
+    Generate the reply into the conversation's Redis stream.
+
+    Partial text is checkpointed for reconnecting clients and the final
+    message is saved to Postgres, independent of who is relaying it. If
+    generation fails midway, what was streamed is saved marked as
+    interrupted, and the checkpoint is always cleared so readers don't keep
+    showing a reply that will never finish.
+    """
+    reply = ""
+    last_checkpoint = time.perf_counter()
+    status = "error"
+    INFLIGHT_REPLIES.inc()
+    try:
+        async for chunk in handle_message(user_id, text, history, pool, cache, conversation_id, tenant):
+            reply += chunk
+            await cache.publish_reply_chunk(conversation_id, chunk, ttl=REPLY_STREAM_TTL)
+
+            now = time.perf_counter()
+            if now - last_checkpoint >= REPLY_CHECKPOINT_INTERVAL_MS / 1000:
+                await cache.checkpoint_reply(conversation_id, reply, ttl=REPLY_CHECKPOINT_TTL)
+                last_checkpoint = now
+
+        await save_reply(pool, cache, conversation_id, reply)
+        status = "ok"
+    except BaseException:  # also cancellation at the shutdown deadline
+        if reply:
+            try:
+                await save_reply(pool, cache, conversation_id, reply + INTERRUPTED_NOTE)
+            except Exception as e:
+                print(f"Could not save interrupted reply for {conversation_id}: {e}")
+        raise
+    finally:
+        INFLIGHT_REPLIES.dec()
+        await cache.clear_reply_checkpoint(conversation_id)
+        await cache.finish_reply_stream(conversation_id, status, ttl=REPLY_STREAM_TTL)
+
+async def serve_reply_job(pool, cache, job):
+    """
+    Run one generation job under admission control.
+
+    Conversations that already have an answer are admitted ahead of new
+    ones; if the job waited past its deadline or no slot frees up in time
+    the user gets a busy message. A job still queued when this worker shuts
+    down goes back on the queue for another worker.
+    """
+    conversation_id = job["conversation_id"]
+    if time.time() - job["enqueued_at"] > CHAT_QUEUE_TIMEOUT_SECONDS:
+        ADMISSION_REJECTED.labels("expired").inc()
+        await cache.publish_reply_chunk(conversation_id, BUSY_MESSAGE, ttl=REPLY_STREAM_TTL)
+        await cache.finish_reply_stream(conversation_id, "ok", ttl=REPLY_STREAM_TTL)
+        return
+
+    history = await get_recent_messages(pool, cache, conversation_id)
+
+    ongoing = any(m["role"] == "assistant" for m in history)
+    # Whatever is left of the job's deadline, not a fresh full timeout
+    remaining = CHAT_QUEUE_TIMEOUT_SECONDS - (time.time() - job["enqueued_at"])
+    try:
+        await admission.acquire(PRIORITY_ONGOING if ongoing else PRIORITY_NEW, timeout=max(0, remaining))
+    except ShuttingDown:
+        await cache.enqueue_reply_job(job)
+        return
+    except Overloaded:
+        await cache.publish_reply_chunk(conversation_id, BUSY_MESSAGE, ttl=REPLY_STREAM_TTL)
+        await cache.finish_reply_stream(conversation_id, "ok", ttl=REPLY_STREAM_TTL)
+        return
+
+    try:
+        await produce_reply(
+            job["user_id"], job["text"], history, pool, cache, conversation_id, get_tenant(job.get("tenant"))
+        )
+    finally:
+        admission.release()
+
+async def run_reply_worker(pool, cache, group="reply-workers", stop=None):
+    """
+    Consume generation jobs from Redis.
+
+    Takes as many jobs as there are free slots plus up to REPLY_PREFETCH
+    more (bounded by the admission queue), so the jobs waiting here are
+    admitted ongoing conversations first rather than in stream order.
+    Claiming only what could start at once would leave admission nothing
+    to prioritise, while prefetching the whole backlog would keep jobs
+    from idle workers.
+
+    Stops taking jobs once `stop` is set; jobs already taken keep running
+    under the supervisor until shutdown drains them.
+    """
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    await cache.ensure_reply_group(group)
+    running = set()
+
+    async def run(job_id, job):
+        try:
+            await serve_reply_job(pool, cache, job)
+        except Exception as e:
+            print(f"Reply job {job_id} failed: {e}")
+            await cache.finish_reply_stream(job["conversation_id"], "error", ttl=REPLY_STREAM_TTL)
+        finally:
+            await cache.ack_reply_job(group, job_id)
+
+    while stop is None or not stop.is_set():
+        free = admission.max_concurrent + min(REPLY_PREFETCH, admission.max_queue) - len(running)
+        if free <= 0:
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            jobs = await cache.claim_reply_jobs(
+                group, consumer, count=free, min_idle_ms=REPLY_JOB_CLAIM_IDLE_MS
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Reply worker error: {e}")
+            await asyncio.sleep(1)
+            continue
+        for job_id, job in jobs:
+            task = supervisor.spawn(run(job_id, job), name=f"reply-{job_id}")
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+async def request_reply(cache, user_id, text, conversation_id, tenant_id=None):
+    """
+    Queue generation of a reply for any worker to pick up.
+
+    Returns:
+        Stream id to relay the reply from, or None if the backlog is full
+    """
+    if await cache.reply_backlog() >= REPLY_MAX_BACKLOG:
+        ADMISSION_REJECTED.labels("queue_full").inc()
+        return None
+    after = await cache.start_reply_stream(conversation_id, ttl=REPLY_STREAM_TTL)
+    await cache.enqueue_reply_job({
+        "user_id": user_id,
+        "text": text,
+        "conversation_id": conversation_id,
+        "tenant": tenant_id,
+        "enqueued_at": time.time(),
+    })
+    return after
+
+async def relay_reply(cache, conversation_id, after="0"):
+    """Yield a reply's chunks from the conversation's Redis stream until it is done"""
+    last_activity = time.perf_counter()
+    while True:
+        entries = await cache.read_reply_stream(conversation_id, after)
+        if not entries:
+            if time.perf_counter() - last_activity > REPLY_RELAY_TIMEOUT_SECONDS:
+                raise TimeoutError("Reply stream stalled")
+            continue
+        last_activity = time.perf_counter()
+
+        for entry_id, fields in entries:
+            after = entry_id
+            if fields["type"] == "chunk":
+                yield fields["data"]
+            elif fields["type"] == "done":
+                if fields["data"] != "ok":
+                    raise RuntimeError("Reply generation failed")
+                return
+
 def normalize_label(raw_label):
     if not raw_label:
         return None
@@ -201,6 +526,19 @@ def escalation_message(ticket_id, created_at):
     )
 
 
+def already_escalated_message(ticket_id, created_at):
+    if not ticket_id:
+        return (
+            "Your request is already being escalated to a human agent. "
+            "They'll get back to you as soon as possible. Is there anything else I can help you with?"
+        )
+    ts = datetime.fromisoformat(created_at).strftime("%Y-%m-%d %H:%M:%S")
+    return (
+        f"This has already been escalated to a human agent (Ticket #{ticket_id} created at {ts}). "
+        "They'll get back to you as soon as possible. Is there anything else I can help you with?"
+    )
+
+
 async def safe_escalate(ticket):
     print("in safe escalate")
     try:
@@ -1,42 +1,65 @@
-from transformers import pipeline
-import time
+import asyncio
+import json
+import re
+import threading
+from core.config import (
+    CLASSIFIER_MODEL, CLASSIFIER_DEVICE, CLASSIFIER_SOCKET,
+    CLASSIFIER_STAGED, CLASSIFIER_EARLY_EXIT_MARGIN, CLASSIFIER_REFINE_BATCH, CLASSIFICATION_REUSE_TURNS,
+)
+from core.metrics import span
 
 CONFIDENCE_THRESHOLD = 0.7      #if lower, kafka
-classifier = pipeline("zero-shot-classification", model="MoritzLaurer/deberta-v3-large-zeroshot-v2.0")
+_classifier = None
+_classifier_lock = threading.Lock()
+
+def get_classifier():
+    """Load the zero-shot pipeline on first use (web workers using the sidecar never load it)"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            from transformers import pipeline
+            _classifier = pipeline("zero-shot-classification", model=CLASSIFIER_MODEL, device=CLASSIFIER_DEVICE)
+    return _classifier
 
 LABELS = [
     {
         "id": "billing",
+        "group": "actionable",
         "name": "Billing Issue",
         "description": "Charges, invoices, overbilling, refunds, payment failures.",
         "synonyms": ["bill", "charge", "invoice", "payment", "refund", "credit card"]
     },
     {
         "id": "connectivity",
+        "group": "actionable",
         "name": "Internet Connectivity",
         "description": "No connection, slow speeds, intermittent drops, latency.",
         "synonyms": ["no internet", "offline", "slow", "lag", "disconnect", "packet loss"]
     },
     {
         "id": "device_config",
+        "group": "actionable",
         "name": "Device Configuration",
         "description": "Router/modem setup, firmware, Wi‑Fi password, port forwarding.",
         "synonyms": ["router", "modem", "firmware", "wifi password", "port forward", "ssid"]
     },
     {
         "id": "cancellation",
+        "group": "actionable",
         "name": "Cancellation",
         "description": "Cancel service, downgrade, upgrade, pause account.",
         "synonyms": ["cancel", "terminate", "end service", "stop plan", "downgrade", "upgrade"]
     },
     {
         "id": "general_info",
+        "group": "actionable",
         "name": "General Information",
         "description": "Pricing plans, coverage, availability, sales questions.",
         "synonyms": ["price", "plan", "available", "coverage", "offer", "promotion"]
     },
     {
         "id": "chitchat",
+        "group": "chitchat",
         "name": "ChitChat",
         "description": "Greetings, thanks, casual conversation not needing action.",
         "synonyms": ["hi", "hello", "thanks", "how are you", "good morning"]
@@ -44,24 +67,187 @@ LABELS = [
 ]
 
 
-def classify(message):
-    start = time.perf_counter()
+# Coarse first-stage hypotheses; every label belongs to one group
+COARSE_GROUPS = {
+    "actionable": "Telecom support request about billing, internet, devices, plans or the account.",
+    "chitchat": "Greetings, thanks or casual conversation that needs no action.",
+}
+HYPOTHESIS_TEMPLATE = "This example is {}."
+
+def candidate_label(lbl):
+    return f"{lbl['name']}: {lbl['description']}"
+
+CANDIDATE_LABELS = [candidate_label(lbl) for lbl in LABELS]
 
-    
-    result = classifier(
-        message,
-        candidate_labels = [f"{lbl['name']}: {lbl['description']}" for lbl in LABELS]
+def entailment_scores(message, hypotheses):
+    """
+    Independent entailment probability of each hypothesis for the message.
+
+    All pairs go through the model in one padded batch; the premise is
+    tokenized with every hypothesis since the NLI model is a cross-encoder.
+    """
+    import torch
+
+    clf = get_classifier()
+    label2id = {k.lower(): v for k, v in clf.model.config.label2id.items()}
+    entail_id = clf.entailment_id
+    contra_id = next(
+        (v for k, v in label2id.items() if k.startswith(("contradiction", "not_entailment"))),
+        1 - entail_id,
     )
 
-    confidence = result["scores"][0]
-    label = result["labels"][0]
+    inputs = clf.tokenizer(
+        [message] * len(hypotheses),
+        [HYPOTHESIS_TEMPLATE.format(h) for h in hypotheses],
+        return_tensors="pt",
+        padding=True,
+        truncation="only_first",
+    ).to(clf.model.device)
+    with torch.inference_mode():
+        logits = clf.model(**inputs).logits
+    return logits[:, [contra_id, entail_id]].softmax(dim=-1)[:, 1].tolist()
+
+class LabelSet:
+    """
+    One tenant's labels with everything classification needs precomputed:
+    candidate texts, lookups and compiled keyword patterns. Built once per
+    tenant and reused for every message.
+    """
+
+    def __init__(self, labels, threshold=CONFIDENCE_THRESHOLD, coarse_groups=None):
+        self.labels = labels
+        self.threshold = threshold
+        self.coarse_groups = coarse_groups or COARSE_GROUPS
+        unknown = {lbl["group"] for lbl in labels} - set(self.coarse_groups)
+        if unknown:
+            raise ValueError(f"Labels use groups without a coarse hypothesis: {sorted(unknown)}")
+
+        self.candidates = [candidate_label(lbl) for lbl in labels]
+        self.by_candidate = dict(zip(self.candidates, labels))
+        self.by_name = {lbl["name"]: lbl for lbl in labels}
+        self.keywords = {
+            lbl["id"]: [re.compile(rf"\b{re.escape(syn)}\b") for syn in lbl["synonyms"]]
+            for lbl in labels
+        }
+
+    def keyword_prior(self, message, lbl):
+        text = message.lower()
+        return sum(1 for pattern in self.keywords[lbl["id"]] if pattern.search(text))
+
+DEFAULT_LABEL_SET = LabelSet(LABELS)
+
+def keyword_prior(message, lbl, label_set=DEFAULT_LABEL_SET):
+    return label_set.keyword_prior(message, lbl)
+
+def label_for(raw_label, label_set=DEFAULT_LABEL_SET):
+    """LABELS entry for a candidate label text returned by classify"""
+    return label_set.by_candidate.get(raw_label)
+
+def is_followup(message, raw_label, turns, label_set=DEFAULT_LABEL_SET):
+    """
+    Whether a message can inherit the conversation's current label.
+
+    Actionable labels carry over for up to CLASSIFICATION_REUSE_TURNS turns
+    unless the message names another label's keywords (topic shift).
+    Chitchat never carries over.
+    """
+    lbl = label_for(raw_label, label_set)
+    if lbl is None or lbl["group"] == "chitchat":
+        return False
+    if turns >= CLASSIFICATION_REUSE_TURNS:
+        return False
+    matched = [other for other in label_set.labels if label_set.keyword_prior(message, other)]
+    return not matched or lbl in matched
+
+def classify_staged(message, label_set=DEFAULT_LABEL_SET):
+    """
+    Two-stage classification with early exit.
+
+    Stage 1 scores the coarse groups. If one wins by at least
+    CLASSIFIER_EARLY_EXIT_MARGIN only its labels are refined, otherwise all
+    labels are. Stage 2 scores candidates CLASSIFIER_REFINE_BATCH at a time,
+    most keyword-matched first, and stops once the leader clears the
+    confidence threshold by the margin.
+
+    Returns:
+        dict with label (candidate label text), confidence and the number
+        of NLI pairs evaluated
+    """
+    groups = sorted({lbl["group"] for lbl in label_set.labels})
+    if len(groups) == 1:
+        ranked = [(groups[0], 1.0)]
+        pairs = 0
+    else:
+        group_scores = entailment_scores(message, [label_set.coarse_groups[g] for g in groups])
+        pairs = len(groups)
+        ranked = sorted(zip(groups, group_scores), key=lambda x: x[1], reverse=True)
+
+    candidates = label_set.labels
+    if len(ranked) == 1 or ranked[0][1] - ranked[1][1] >= CLASSIFIER_EARLY_EXIT_MARGIN:
+        candidates = [lbl for lbl in label_set.labels if lbl["group"] == ranked[0][0]]
+        if len(candidates) == 1:
+            return {"label": candidate_label(candidates[0]), "confidence": ranked[0][1], "pairs": pairs}
+
+    candidates = sorted(candidates, key=lambda lbl: label_set.keyword_prior(message, lbl), reverse=True)
+    scored = []
+    for i in range(0, len(candidates), CLASSIFIER_REFINE_BATCH):
+        batch = candidates[i:i + CLASSIFIER_REFINE_BATCH]
+        scores = entailment_scores(message, [candidate_label(lbl) for lbl in batch])
+        pairs += len(batch)
+        scored = sorted(scored + list(zip(batch, scores)), key=lambda x: x[1], reverse=True)
+
+        top = scored[0][1]
+        runner_up = scored[1][1] if len(scored) > 1 else 0.0
+        if top > label_set.threshold and top - runner_up >= CLASSIFIER_EARLY_EXIT_MARGIN:
+            break
+
+    return {"label": candidate_label(scored[0][0]), "confidence": scored[0][1], "pairs": pairs}
+
+def is_confident(confidence, label_set=DEFAULT_LABEL_SET):
+    return confidence is not None and confidence > label_set.threshold
+
+def classify(message, label_set=DEFAULT_LABEL_SET):
+    if CLASSIFIER_STAGED:
+        with span("classification"):
+            result = classify_staged(message, label_set)
+        label, confidence = result["label"], result["confidence"]
+        return label, confidence
 
-    print(result)
+    with span("classification"):
+        result = get_classifier()(
+            message,
+            candidate_labels = label_set.candidates
+        )
 
-    total = time.perf_counter() - start
-    print(f"Total classification duration: {total:.2f} seconds")
+    # The best guess even below the threshold: low-confidence escalations still record it
+    return result["labels"][0], result["scores"][0]
 
+async def classify_async(message, tenant=None):
+    """
+    Classify without blocking the event loop.
 
-    return (label, confidence) if confidence > CONFIDENCE_THRESHOLD else (None, None)
+    Goes to the shared classifier sidecar (services/classifier_worker.py)
+    when CLASSIFIER_SOCKET is set, otherwise runs the in-process model in a
+    thread. `tenant` (services.tenants.Tenant) selects the label set; the
+    sidecar resolves it from the same registry by id.
+    """
+    if not CLASSIFIER_SOCKET:
+        label_set = tenant.label_set if tenant is not None else DEFAULT_LABEL_SET
+        return await asyncio.to_thread(classify, message, label_set)
 
+    request = {"text": message}
+    if tenant is not None:
+        request["tenant"] = tenant.id
+    with span("classification_rpc"):
+        reader, writer = await asyncio.open_unix_connection(CLASSIFIER_SOCKET)
+        try:
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline())
+        finally:
+            writer.close()
+            await writer.wait_closed()
 
+    if "error" in response:
+        raise RuntimeError(f"Classifier worker error: {response['error']}")
+    return response["label"], response["confidence"]
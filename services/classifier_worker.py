@@ -0,0 +1,73 @@
+"""
+Shared classifier sidecar.
+
+Loads the model once, then forks CLASSIFIER_WORKERS processes that inherit
+the weights copy-on-write, so a node holds one copy of the model no matter
+how many web workers it runs. Web workers submit messages over the Unix
+socket at CLASSIFIER_SOCKET (one JSON object per line each way); a
+request's "tenant" selects that tenant's label set from the registry.
+
+Usage:
+    CLASSIFIER_SOCKET=/tmp/classifier.sock python -m services.classifier_worker
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from core.config import CLASSIFIER_SOCKET, CLASSIFIER_WORKERS, CLASSIFIER_INTRA_OP_THREADS
+from services.classifier import classify, get_classifier
+from services.tenants import get_tenant
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+def classify_for_tenant(text, tenant_id):
+    # Resolved in the worker process, which keeps its own precompiled label sets
+    return classify(text, get_tenant(tenant_id).label_set)
+
+async def handle_client(reader, writer, executor):
+    loop = asyncio.get_running_loop()
+    try:
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+                label, confidence = await loop.run_in_executor(
+                    executor, classify_for_tenant, request["text"], request.get("tenant")
+                )
+                response = {"label": label, "confidence": confidence}
+            except Exception as e:
+                response = {"error": str(e)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(path):
+    # Load before forking so every worker shares the same weight pages
+    get_classifier()
+    executor = ProcessPoolExecutor(
+        max_workers=CLASSIFIER_WORKERS,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(CLASSIFIER_INTRA_OP_THREADS,),
+    )
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(
+        lambda r, w: handle_client(r, w, executor), path=path
+    )
+    print(f"Classifier worker listening on {path} "
+          f"({CLASSIFIER_WORKERS} processes x {CLASSIFIER_INTRA_OP_THREADS} threads)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    if not CLASSIFIER_SOCKET:
+        raise SystemExit("Set CLASSIFIER_SOCKET to the Unix socket path to listen on")
+    asyncio.run(serve(CLASSIFIER_SOCKET))
@@ -0,0 +1,251 @@
+"""
+Knowledge base for retrieval-augmented answers.
+
+Ingestion chunks Markdown/text docs, embeds the chunks and writes an
+on-disk index to KB_INDEX_DIR: vectors.npy (normalized float32 rows,
+memory-mapped at query time) and chunks.jsonl (text, source, labels and a
+token estimate per row).
+
+A doc under a subdirectory named after a label id (e.g. docs/billing/)
+is only retrieved for that label; everything else is "general" and is
+retrieved for every label. Each tenant can have its own index
+(kb_index_dir in the tenant registry), built against its label ids.
+
+Usage:
+    python -m services.knowledge_base docs/
+    python -m services.knowledge_base acme-docs/ --tenant acme
+
+The server loads the index on first use; restart it after re-ingesting.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+from pathlib import Path
+import numpy as np
+from core.config import (
+    KB_INDEX_DIR, KB_EMBEDDING_MODEL, KB_CHUNK_TOKENS, KB_TOP_K, KB_TOKEN_BUDGET, KB_MIN_SCORE,
+)
+from core.metrics import span
+from services.tenants import get_tenant
+from services.classifier import label_for
+
+GENERAL = "general"
+EMBED_BATCH = 100
+
+_indexes = {}
+_index_lock = threading.Lock()
+_client = None
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# =============================================================================
+# INGESTION
+# =============================================================================
+
+def split_sections(text):
+    """(heading path, body) per Markdown section"""
+    path, body, sections = [], [], []
+    for line in text.splitlines():
+        heading = re.match(r"^(#{1,6})\s+(.*)", line)
+        if heading:
+            if "".join(body).strip():
+                sections.append((" > ".join(path), "\n".join(body)))
+            level = len(heading.group(1))
+            path = path[:level - 1] + [heading.group(2).strip()]
+            body = []
+        else:
+            body.append(line)
+    if "".join(body).strip():
+        sections.append((" > ".join(path), "\n".join(body)))
+    return sections
+
+def chunk_document(text, max_tokens=KB_CHUNK_TOKENS):
+    """
+    Split a document into chunks of whole paragraphs up to max_tokens.
+
+    Chunks never span sections, and each is prefixed with its heading path
+    so the snippet still makes sense on its own.
+    """
+    chunks = []
+    for heading, body in split_sections(text):
+        prefix = f"{heading}\n" if heading else ""
+        current = []
+        for para in (p.strip() for p in re.split(r"\n\s*\n", body)):
+            if not para:
+                continue
+            candidate = "\n\n".join(current + [para])
+            if current and estimate_tokens(prefix + candidate) > max_tokens:
+                chunks.append(prefix + "\n\n".join(current))
+                current = [para]
+            else:
+                current.append(para)
+        if current:
+            chunks.append(prefix + "\n\n".join(current))
+    return chunks
+
+def doc_labels(path, root, label_ids):
+    top = path.relative_to(root).parts[0]
+    return [top] if top in label_ids else [GENERAL]
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def ingest(docs_dir, index_dir=KB_INDEX_DIR, label_ids=()):
+    """Chunk and embed every .md/.txt file under docs_dir and write the index"""
+    from openai import OpenAI
+
+    root = Path(docs_dir)
+    chunks = []
+    for path in sorted(p for p in root.rglob("*") if p.suffix in (".md", ".txt")):
+        labels = doc_labels(path, root, label_ids)
+        for text in chunk_document(path.read_text(encoding="utf-8")):
+            chunks.append({
+                "text": text,
+                "source": str(path.relative_to(root)),
+                "labels": labels,
+                "tokens": estimate_tokens(text),
+            })
+    if not chunks:
+        raise SystemExit(f"No .md/.txt documents found under {docs_dir}")
+
+    client = OpenAI()
+    vectors = []
+    for i in range(0, len(chunks), EMBED_BATCH):
+        batch = [c["text"] for c in chunks[i:i + EMBED_BATCH]]
+        resp = client.embeddings.create(model=KB_EMBEDDING_MODEL, input=batch)
+        vectors.extend(d.embedding for d in resp.data)
+        print(f"Embedded {min(i + EMBED_BATCH, len(chunks))}/{len(chunks)} chunks")
+
+    # Write beside the live files and swap them in, so a running server never reads half a file
+    os.makedirs(index_dir, exist_ok=True)
+    chunks_path, vectors_path = Path(index_dir, "chunks.jsonl"), Path(index_dir, "vectors.npy")
+    with open(f"{chunks_path}.tmp", "w", encoding="utf-8") as f:
+        for c in chunks:
+            f.write(json.dumps(c) + "\n")
+    with open(f"{vectors_path}.tmp", "wb") as f:
+        np.save(f, normalize(vectors))
+    os.replace(f"{chunks_path}.tmp", chunks_path)
+    os.replace(f"{vectors_path}.tmp", vectors_path)
+    print(f"Indexed {len(chunks)} chunks into {index_dir}")
+
+# =============================================================================
+# INDEX
+# =============================================================================
+
+class KnowledgeIndex:
+    """Memory-mapped chunk vectors with per-label row sets"""
+
+    def __init__(self, index_dir):
+        self.vectors = np.load(Path(index_dir, "vectors.npy"), mmap_mode="r")
+        with open(Path(index_dir, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+        if len(self.chunks) != self.vectors.shape[0]:
+            raise ValueError(f"{index_dir}: {len(self.chunks)} chunks but {self.vectors.shape[0]} vectors")
+
+        self.all_rows = np.arange(len(self.chunks))
+        self._rows = {}
+
+    def rows_for(self, label_id):
+        """Rows of the label's chunks plus the general ones, computed once per label"""
+        if label_id is None:
+            return self.all_rows
+        if label_id not in self._rows:
+            self._rows[label_id] = np.array(
+                [i for i, c in enumerate(self.chunks) if label_id in c["labels"] or GENERAL in c["labels"]],
+                dtype=np.int64,
+            )
+        return self._rows[label_id]
+
+    def search(self, query_vector, label_id=None, k=KB_TOP_K):
+        """Top-k (chunk, cosine score) among the label's rows, best first"""
+        rows = self.rows_for(label_id)
+        if not len(rows):
+            return []
+        scores = self.vectors[rows] @ query_vector
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[rows[i]], float(scores[i])) for i in top]
+
+def get_index(index_dir=KB_INDEX_DIR):
+    """Load an index on first use; None when nothing has been ingested there"""
+    with _index_lock:
+        if index_dir not in _indexes:
+            if not Path(index_dir, "vectors.npy").exists():
+                return None
+            _indexes[index_dir] = KnowledgeIndex(index_dir)
+            print(f"Loaded knowledge base {index_dir}: {len(_indexes[index_dir].chunks)} chunks")
+    return _indexes[index_dir]
+
+# =============================================================================
+# RETRIEVAL
+# =============================================================================
+
+async def embed_query(text):
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI()
+    resp = await _client.embeddings.create(model=KB_EMBEDDING_MODEL, input=[text])
+    return normalize(resp.data[0].embedding)
+
+async def retrieve(text, raw_label=None, tenant=None, k=KB_TOP_K, token_budget=KB_TOKEN_BUDGET):
+    """
+    Best-matching chunks for a message, restricted to the classifier label
+    (`raw_label` is the candidate label text classify returns).
+
+    Chunks under KB_MIN_SCORE are dropped, and the rest are taken best
+    first while they fit in token_budget.
+    """
+    tenant = tenant or get_tenant()
+    index = get_index(tenant.kb_index_dir)
+    lbl = label_for(raw_label, tenant.label_set)
+    if index is None or (lbl is not None and lbl["group"] == "chitchat"):
+        return []
+    with span("kb_retrieval"):
+        query_vector = await embed_query(text)
+        hits = index.search(query_vector, lbl["id"] if lbl else None, k)
+
+    selected, used = [], 0
+    for chunk, score in hits:
+        if score < KB_MIN_SCORE:
+            break
+        if used + chunk["tokens"] > token_budget:
+            continue
+        selected.append(chunk)
+        used += chunk["tokens"]
+    return selected
+
+async def knowledge_context(text, raw_label, tenant=None):
+    """System message with the retrieved snippets, or [] if nothing relevant/available"""
+    try:
+        chunks = await retrieve(text, raw_label, tenant)
+    except Exception as e:  # answer without documentation rather than fail the reply
+        print(f"Knowledge base retrieval failed: {e}")
+        return []
+    if not chunks:
+        return []
+    snippets = "\n\n---\n\n".join(f"[{c['source']}]\n{c['text']}" for c in chunks)
+    return [{
+        "role": "system",
+        "content": (
+            "Reference documentation for this request. Use the menu names, buttons and steps exactly as "
+            "written here; if it does not cover the question, say so instead of guessing.\n\n" + snippets
+        ),
+    }]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the knowledge base index")
+    parser.add_argument("docs_dir", help="directory of .md/.txt documents")
+    parser.add_argument("--tenant", help="tenant id whose label ids and index directory to use")
+    parser.add_argument("--index-dir", help="override the tenant's index directory")
+    args = parser.parse_args()
+    tenant = get_tenant(args.tenant)
+    if args.tenant and tenant.id != args.tenant:
+        raise SystemExit(f"Unknown tenant {args.tenant!r}")
+    ingest(args.docs_dir, args.index_dir or tenant.kb_index_dir, [lbl["id"] for lbl in tenant.label_set.labels])
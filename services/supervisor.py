@@ -0,0 +1,41 @@
+"""Background task tracking, so shutdown can wait for work still in flight"""
+import asyncio
+import time
+
+class TaskSupervisor:
+    def __init__(self):
+        self.tasks = set()
+
+    def spawn(self, coro, name=None):
+        """asyncio.create_task that shutdown waits for (and that keeps a reference to the task)"""
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+    async def drain(self, deadline):
+        """
+        Wait until `deadline` (time.monotonic()) for tracked tasks, including
+        ones spawned while draining, then cancel the rest.
+
+        Returns:
+            Number of tasks cancelled
+        """
+        while self.tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait(set(self.tasks), timeout=remaining)
+
+        leftover = set(self.tasks)
+        for task in leftover:
+            task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+        return len(leftover)
+
+supervisor = TaskSupervisor()
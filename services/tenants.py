@@ -0,0 +1,96 @@
+"""
+Tenant registry.
+
+One deployment serves every brand. Each tenant has its own label set,
+confidence threshold, system prompt, Kafka ticket topic, chat model and
+knowledge base; anything a tenant leaves out falls back to the built-in
+single-brand configuration. Tenants are read from the JSON file at
+TENANTS_FILE:
+
+    {
+      "acme": {
+        "hosts": ["support.acme.example"],
+        "system_prompt": "You are an expert support engineer for Acme ...",
+        "labels": [{"id": "billing", "group": "actionable", "name": "Billing Issue",
+                    "description": "...", "synonyms": ["bill", "invoice"]}],
+        "confidence_threshold": 0.6,
+        "tickets_topic": "acme-tickets",
+        "kafka_bootstrap": "kafka.acme.internal:9092",
+        "model": "gpt-4o-mini",
+        "kb_index_dir": "kb_index/acme"
+      }
+    }
+
+Requests are mapped to a tenant by host (X-Forwarded-Host from a trusted
+proxy, otherwise Host); unclaimed hosts get DEFAULT_TENANT. A tenant's classifier state
+(LabelSet) is built the first time one of its messages is classified.
+"""
+import json
+import threading
+from functools import cached_property
+from core.proxies import request_host
+from core.config import (
+    TENANTS_FILE, DEFAULT_TENANT, KAFKA_BOOTSTRAP, TICKETS_TOPIC, CHAT_MODEL, KB_INDEX_DIR,
+)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+class Tenant:
+    def __init__(self, tenant_id, config):
+        self.id = tenant_id
+        self.hosts = [h.lower() for h in config.get("hosts", [])]
+        self.system_prompt = config.get("system_prompt")  # None = the built-in prompt
+        self.labels = config.get("labels")  # None = the built-in labels
+        self.confidence_threshold = config.get("confidence_threshold")
+        self.coarse_groups = config.get("coarse_groups")
+        self.tickets_topic = config.get("tickets_topic", TICKETS_TOPIC)
+        self.kafka_bootstrap = config.get("kafka_bootstrap", KAFKA_BOOTSTRAP)
+        self.model = config.get("model", CHAT_MODEL)
+        self.kb_index_dir = config.get("kb_index_dir", KB_INDEX_DIR)
+
+    @cached_property
+    def label_set(self):
+        """Precompiled classifier state, built on first use"""
+        from services.classifier import LabelSet, LABELS, CONFIDENCE_THRESHOLD
+        return LabelSet(
+            self.labels if self.labels is not None else LABELS,
+            self.confidence_threshold if self.confidence_threshold is not None else CONFIDENCE_THRESHOLD,
+            self.coarse_groups,
+        )
+
+def load_registry(path=TENANTS_FILE):
+    """{tenant id: Tenant}; always contains DEFAULT_TENANT"""
+    config = {}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    config.setdefault(DEFAULT_TENANT, {})
+    return {tenant_id: Tenant(tenant_id, c) for tenant_id, c in config.items()}
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = load_registry()
+            print(f"Loaded {len(_registry)} tenant(s)")
+    return _registry
+
+def get_tenant(tenant_id=None):
+    """Tenant by id; unknown ids (e.g. removed since a job was queued) get the default"""
+    registry = get_registry()
+    return registry.get(tenant_id) or registry[DEFAULT_TENANT]
+
+def tenant_for_host(host):
+    host = (host or "").split(",")[0].strip().split(":")[0].lower()
+    for tenant in get_registry().values():
+        if host in tenant.hosts:
+            return tenant
+    return get_tenant(DEFAULT_TENANT)
+
+def tenant_for_request(request):
+    """Tenant for an API request; the UI forwards the browser's host as X-Forwarded-Host over loopback"""
+    return tenant_for_host(request_host(request))
+
+def all_tenants():
+    return list(get_registry().values())
@@ -0,0 +1,158 @@
+"""
+Ticket analytics consumer.
+
+Reads escalations (every tenant's ticket topic on this cluster) and
+per-message events (support-messages) from Kafka in batches and keeps
+hourly per-tenant, per-label counts in ticket_stats_hourly, so
+dashboards never scan the raw tickets table. Tenants define their own
+labels, so counts are never merged across tenants. Each batch's counts
+and the consumed offsets are written in one Postgres transaction and
+partitions resume from the stored offsets, so a crash never
+double-counts or skips a batch.
+
+Usage:
+    python -m core.migrate   # creates the tables
+    python -m services.ticket_analytics
+
+consume() takes any object with aiokafka's getmany(), e.g.
+bench.stubs.FakeKafkaConsumer for running against canned events.
+"""
+import asyncio
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from core.config import (
+    KAFKA_BOOTSTRAP, TICKETS_TOPIC, MESSAGES_TOPIC, DEFAULT_TENANT,
+    ANALYTICS_GROUP, ANALYTICS_BATCH_SIZE, ANALYTICS_POLL_MS,
+)
+from core.database import create_database_pool
+from services.tenants import all_tenants
+
+# =============================================================================
+# AGGREGATION
+# =============================================================================
+
+def hour_bucket(ts):
+    when = datetime.fromisoformat(ts) if ts else datetime.now(timezone.utc)
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def aggregate(records):
+    """
+    Fold a batch of Kafka records into per-(tenant, hour, label) counts.
+
+    Returns:
+        (messages Counter, escalations Counter)
+    """
+    messages, escalations = Counter(), Counter()
+    for record in records:
+        try:
+            ticket = json.loads(record.value)
+        except (TypeError, ValueError):
+            print(f"Skipping malformed record at {record.topic}:{record.partition}:{record.offset}")
+            continue
+        key = (
+            ticket.get("tenant") or DEFAULT_TENANT,
+            hour_bucket(ticket.get("ts")),
+            ticket.get("label") or "unlabeled",
+        )
+        if record.topic == MESSAGES_TOPIC:
+            messages[key] += 1
+        elif ticket.get("escalated"):
+            escalations[key] += 1
+    return messages, escalations
+
+async def apply_batch(pool, messages, escalations, offsets, group=ANALYTICS_GROUP):
+    """Upsert counts and store offsets ({TopicPartition: next offset}) atomically"""
+    rows = [
+        (*key, messages.get(key, 0), escalations.get(key, 0))
+        for key in set(messages) | set(escalations)
+    ]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(
+                """
+                INSERT INTO ticket_stats_hourly (tenant, hour, label, messages, escalations)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (tenant, hour, label) DO UPDATE
+                SET messages = ticket_stats_hourly.messages + EXCLUDED.messages,
+                    escalations = ticket_stats_hourly.escalations + EXCLUDED.escalations
+                """,
+                rows,
+            )
+            await conn.executemany(
+                """
+                INSERT INTO analytics_offsets (consumer_group, topic, partition, next_offset)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (consumer_group, topic, partition) DO UPDATE
+                SET next_offset = EXCLUDED.next_offset
+                """,
+                [(group, tp.topic, tp.partition, offset) for tp, offset in offsets.items()],
+            )
+
+async def stored_offsets(pool, partitions, group=ANALYTICS_GROUP):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT topic, partition, next_offset FROM analytics_offsets WHERE consumer_group=$1",
+            group,
+        )
+    known = {TopicPartition(r["topic"], r["partition"]): r["next_offset"] for r in rows}
+    return {tp: known[tp] for tp in partitions if tp in known}
+
+# =============================================================================
+# CONSUMER LOOP
+# =============================================================================
+
+class ResumeFromStoredOffsets(ConsumerRebalanceListener):
+    """Seek newly assigned partitions to the offsets committed with the aggregates"""
+
+    def __init__(self, consumer, pool):
+        self.consumer = consumer
+        self.pool = pool
+
+    async def on_partitions_revoked(self, revoked):
+        pass
+
+    async def on_partitions_assigned(self, assigned):
+        for tp, offset in (await stored_offsets(self.pool, assigned)).items():
+            self.consumer.seek(tp, offset)
+
+async def consume(pool, consumer, stop=None):
+    """
+    Aggregate batches until `stop` is set.
+
+    `consumer` is anything with aiokafka's getmany(); the offsets are
+    tracked in Postgres, so it doesn't need to commit on its own.
+    """
+    while stop is None or not stop.is_set():
+        batches = await consumer.getmany(timeout_ms=ANALYTICS_POLL_MS, max_records=ANALYTICS_BATCH_SIZE)
+        if not batches:
+            continue
+        records = [r for partition_records in batches.values() for r in partition_records]
+        messages, escalations = aggregate(records)
+        offsets = {tp: partition_records[-1].offset + 1 for tp, partition_records in batches.items()}
+        await apply_batch(pool, messages, escalations, offsets)
+
+async def main():
+    pool = await create_database_pool()
+    consumer = AIOKafkaConsumer(
+        bootstrap_servers=KAFKA_BOOTSTRAP,
+        group_id=ANALYTICS_GROUP,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest",
+        isolation_level="read_committed",
+    )
+    # Every tenant's ticket topic on this cluster
+    topics = {TICKETS_TOPIC, MESSAGES_TOPIC} | {
+        t.tickets_topic for t in all_tenants() if t.kafka_bootstrap == KAFKA_BOOTSTRAP
+    }
+    consumer.subscribe(sorted(topics), listener=ResumeFromStoredOffsets(consumer, pool))
+    await consumer.start()
+    try:
+        await consume(pool, consumer)
+    finally:
+        await consumer.stop()
+        await pool.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,6 +2,7 @@
 import os
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from core.metrics import span
 
 load_dotenv()
 openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
@@ -35,12 +36,13 @@ Examples:
 
 Title:"""
 
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o-mini",  # Fast and cost-effective
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=20,  # Keep it short
-            temperature=0.3,  # Consistent but not too rigid
-        )
+        with span("title_generation"):
+            response = await openai_client.chat.completions.create(
+                model="gpt-4o-mini",  # Fast and cost-effective
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=20,  # Keep it short
+                temperature=0.3,  # Consistent but not too rigid
+            )
         
         title = response.choices[0].message.content.strip()
         
@@ -0,0 +1,39 @@
+"""Fast-path escalation only fires on explicit, whole-message requests for a human"""
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from services.chatbot import is_escalation_request
+
+
+@pytest.mark.parametrize("text", [
+    "agent",
+    "Human!",
+    "representative please",
+    "talk to a human",
+    "Can I speak to a manager?",
+    "I want to talk to a real person please",
+    "connect me to an agent",
+    "get me a human now",
+    "escalate my ticket",
+    "Please escalate this.",
+])
+def test_explicit_requests_take_the_fast_path(text):
+    assert is_escalation_request(text)
+
+
+@pytest.mark.parametrize("text", [
+    "I don't need a human, just tell me how to reset the router",
+    "no need to escalate, it's working now",
+    "my supervisor wants to know the price of the family plan",
+    "is there a sales representative discount?",
+    "What does the ESCALATE button in the app do?",
+    "don't escalate",
+    "not an agent",
+    "my router keeps dropping, talk to a human if you can't fix it",
+])
+def test_mentions_and_negations_go_to_the_llm(text):
+    assert not is_escalation_request(text)
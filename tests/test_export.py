@@ -0,0 +1,39 @@
+"""Parquet export streams one row group at a time"""
+import asyncio
+import io
+import os
+
+import pytest
+
+os.environ.setdefault("REDIS_PORT", "6379")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from api.conversations import export_routes
+
+
+async def fake_records(pool, user_id, conversations=3, messages=25):
+    for c in range(conversations):
+        cid = f"c{c}"
+        yield {"type": "conversation", "id": cid, "title": f"Conversation {c}", "updated_at": "2026-01-01T00:00:00"}
+        for m in range(messages):
+            yield {"type": "message", "conversation_id": cid, "role": "user", "content": f"message {m}"}
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_parquet_export_spans_several_row_groups(monkeypatch):
+    monkeypatch.setattr(export_routes, "iter_export_records", fake_records)
+    monkeypatch.setattr(export_routes, "EXPORT_PREFETCH", 10)
+
+    chunks = asyncio.run(collect(export_routes.parquet_export(None, "user")))
+
+    # a chunk per full row group plus the tail, each holding only new bytes
+    assert len(chunks) == 8
+    parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet.metadata.num_row_groups == 8
+    table = parquet.read()
+    assert table.num_rows == 75
+    assert table.column("title")[74].as_py() == "Conversation 2"
+    assert table.column("content")[74].as_py() == "message 24"
@@ -1,8 +1,40 @@
 """Chat page UI"""
+import json
+import re
 import gradio as gr
 import httpx
-from services.chatbot import handle_message
-from core.config import BASE_URL
+from ui.streaming import coalesce_stream
+from core.config import BASE_URL, SIDEBAR_LIMIT
+from core.proxies import request_host
+
+async def stream_reply(sid, cid, user_text, host=None):
+    """Request a reply and relay it from whichever worker generates it"""
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=None) as client:
+        # The browser's host picks the tenant (brand) that answers
+        headers = {"x-sid": sid, "x-forwarded-host": host} if host else {"x-sid": sid}
+        resp = await client.post(f"/conversations/{cid}/reply", headers=headers,
+                                 json={"content": user_text})
+        if resp.status_code != 200:
+            yield resp.json().get("detail", "Something went wrong, please try again.")
+            return
+
+        async with client.stream("GET", f"/conversations/{cid}/reply/stream", headers={"x-sid": sid},
+                                 params={"after": resp.json()["after"]}) as relay:
+            async for line in relay.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+                yield event["delta"]
+
+def sidebar_choices(conversations):
+    return [(c["title"] or "Untitled", c["id"]) for c in conversations]
+
+def sidebar_upsert(conversations, conversation):
+    """Put a conversation at the top of the session's sidebar model, replacing its old entry"""
+    rest = [c for c in conversations if c["id"] != conversation["id"]]
+    return ([conversation] + rest)[:SIDEBAR_LIMIT]
 
 def create_chat_page():
     """Create the chat page interface"""
@@ -151,6 +183,19 @@ def create_chat_page():
             with gr.Column(scale=1, elem_classes=["sidebar"]):
                 gr.Markdown("## Conversations", elem_classes=["sidebar-header"])
                 new_chat_btn = gr.Button("+ New Chat", variant="primary", elem_classes=["new-chat-btn"])
+
+                search_box = gr.Textbox(
+                    placeholder="Search conversations…",
+                    container=False,
+                    show_label=False,
+                )
+                search_results = gr.Radio(
+                    choices=[],
+                    label="Search results",
+                    interactive=True,
+                    visible=False,
+                    elem_classes=["conversation-item"]
+                )
                 
                 # Conversation list using Radio buttons for better UX
                 conversation_list = gr.Radio(
@@ -182,25 +227,38 @@ def create_chat_page():
                     
                     status = gr.Markdown()
 
+        # Per-session sidebar model, updated in place instead of refetching the list
+        sidebar = gr.State([])
+        # Titles of the conversations in the current search results, by id
+        search_titles = gr.State({})
+
         async def load_boot(request: gr.Request):
             """Load initial data on page load"""
             sid = request.cookies.get("sid")
             if not sid:
-                return gr.update(choices=[]), [], "Not logged in. Redirecting to /login..."
+                return gr.update(choices=[]), [], "Not logged in. Redirecting to /login...", []
             
             async with httpx.AsyncClient(base_url=BASE_URL) as client:
                 resp = await client.get("/conversations/boot", headers={"x-sid": sid})
                 if resp.status_code != 200:
-                    return gr.update(choices=[]), [], "Session expired. Redirecting to /login..."
+                    return gr.update(choices=[]), [], "Session expired. Redirecting to /login...", []
                 
                 data = resp.json()
-                convs = data["conversations"]
-                choices = [(c['title'] or 'Untitled', c['id']) for c in convs]
+                convs = [{"id": c["id"], "title": c["title"]} for c in data["conversations"]]
                 curr_id = data["last_conversation_id"]
+                if curr_id is None:
+                    # First visit: boot is read-only, so create the first conversation explicitly
+                    resp = await client.post("/conversations/bootstrap", headers={"x-sid": sid})
+                    if resp.status_code != 200:
+                        return gr.update(choices=[]), [], "Could not start a conversation, please reload.", []
+                    created = resp.json()
+                    curr_id = created["id"]
+                    if created["created"]:
+                        convs = sidebar_upsert(convs, {"id": created["id"], "title": created["title"]})
                 current_value = curr_id  # Direct ID selection
-                return gr.update(choices=choices, value=current_value), data["messages"], ""
+                return gr.update(choices=sidebar_choices(convs), value=current_value), data["messages"], "", convs
 
-        chat_page.load(load_boot, inputs=None, outputs=[conversation_list, chatbot, status])
+        chat_page.load(load_boot, inputs=None, outputs=[conversation_list, chatbot, status, sidebar])
 
         async def pick_conversation(conversation_id, request: gr.Request):
             """Switch to a different conversation"""
@@ -213,54 +271,102 @@ def create_chat_page():
                 msgs = await client.get(f"/conversations/{conversation_id}/messages", headers={"x-sid": sid})
                 return msgs.json() if msgs.status_code == 200 else []
 
-        async def create_new_chat(request: gr.Request):
+        async def create_new_chat(convs, request: gr.Request):
             """Create a new conversation"""
             sid = request.cookies.get("sid")
             if not sid:
-                return gr.update(), []
+                return gr.update(), [], convs
             
             async with httpx.AsyncClient(base_url=BASE_URL) as client:
                 # Create new conversation
                 resp = await client.post("/conversations", headers={"x-sid": sid}, 
                                        json={"title": "New Conversation"})
                 if resp.status_code != 200:
-                    return gr.update(), []
-                
-                # Refresh conversation list
-                convs = await client.get("/conversations", headers={"x-sid": sid})
-                if convs.status_code != 200:
-                    return gr.update(), []
-                
-                convs = convs.json()
-                choices = [(c['title'] or 'Untitled', c['id']) for c in convs]
-                new_conv_id = convs[0]['id'] if convs else None  # New conversation should be first
-                
-                return gr.update(choices=choices, value=new_conv_id), []
+                    return gr.update(), [], convs
+
+            # New conversation goes first; no need to refetch the whole list
+            created = resp.json()
+            convs = sidebar_upsert(convs, {"id": created["id"], "title": created["title"]})
+            return gr.update(choices=sidebar_choices(convs), value=created["id"]), [], convs
+
+        async def run_search(query, request: gr.Request):
+            """Search titles and messages; hide the results when the query is cleared"""
+            sid = request.cookies.get("sid")
+            if not (sid and query.strip()):
+                return gr.update(choices=[], value=None, visible=False), {}
+
+            async with httpx.AsyncClient(base_url=BASE_URL) as client:
+                resp = await client.get("/conversations/search", headers={"x-sid": sid}, params={"q": query})
+                if resp.status_code != 200:
+                    return gr.update(choices=[], value=None, visible=False), {}
+
+            choices = []
+            titles = {}
+            seen = set()
+            for hit in resp.json()["results"]:
+                # One entry per conversation, labelled by its best match; «» marks the matched words
+                if hit["conversation_id"] in seen:
+                    continue
+                seen.add(hit["conversation_id"])
+                titles[hit["conversation_id"]] = hit["title"]
+                snippet = re.sub(r"\*\*(.+?)\*\*", r"«\1»", hit["snippet"])
+                label = hit["title"] or "Untitled"
+                if hit["kind"] != "title":
+                    label = f"{label}: {snippet}"
+                choices.append((label, hit["conversation_id"]))
+            return gr.update(
+                choices=choices, value=None, visible=True,
+                label="Search results" if choices else "No matches",
+            ), titles
+
+        async def open_search_result(conversation_id, convs, titles):
+            """
+            Select a search hit in the sidebar, adding it if it isn't listed,
+            so it is also the conversation the next message is sent to.
+            Selecting it loads the messages via conversation_list.change.
+            """
+            if not conversation_id:
+                return gr.update(), convs
+            if not any(c["id"] == conversation_id for c in convs):
+                convs = sidebar_upsert(convs, {"id": conversation_id, "title": titles.get(conversation_id, "")})
+            return gr.update(choices=sidebar_choices(convs), value=conversation_id), convs
 
         # Event bindings
+        search_box.submit(run_search, inputs=[search_box], outputs=[search_results, search_titles])
+        search_results.change(open_search_result, inputs=[search_results, sidebar, search_titles],
+                              outputs=[conversation_list, sidebar])
         conversation_list.change(pick_conversation, inputs=[conversation_list], outputs=[chatbot])
-        new_chat_btn.click(create_new_chat, inputs=[], outputs=[conversation_list, chatbot])
+        new_chat_btn.click(create_new_chat, inputs=[sidebar], outputs=[conversation_list, chatbot, sidebar])
 
-        async def on_send(user_text, messages, request: gr.Request):
+        async def on_send(user_text, messages, selected, convs, request: gr.Request):
             """Handle sending a message"""
             sid = request.cookies.get("sid")
             if not sid:
-                yield messages + [{"role": "assistant", "content": "Please log in."}], "", gr.update()
+                yield messages + [{"role": "assistant", "content": "Please log in."}], "", gr.update(), convs
                 return
 
             # STEP 1: Show user message immediately
             messages = list(messages or [])
             messages.append({"role": "user", "content": user_text})
-            yield messages, "", gr.update()
+            yield messages, "", gr.update(), convs
 
             # STEP 2: Show "thinking" indicator
             messages.append({"role": "assistant", "content": "..."})
-            yield messages, "", gr.update()
+            yield messages, "", gr.update(), convs
 
             # STEP 3: Save user message to database (in background)
             async with httpx.AsyncClient(base_url=BASE_URL) as client:
-                boot = await client.get("/conversations/boot", headers={"x-sid": sid})
-                cid = boot.json()["last_conversation_id"]
+                # The selected conversation is the current one; ask the server only if nothing is selected
+                cid = selected
+                if not cid:
+                    current = await client.get("/conversations/current", headers={"x-sid": sid})
+                    cid = current.json()["conversation_id"]
+                if not cid:
+                    created = (await client.post("/conversations/bootstrap", headers={"x-sid": sid})).json()
+                    cid = created["id"]
+                    if created["created"]:
+                        convs = sidebar_upsert(convs, {"id": created["id"], "title": created["title"]})
+                        yield messages, "", gr.update(choices=sidebar_choices(convs), value=cid), convs
                 
                 # Check if this is the first message
                 first_check = await client.get(f"/conversations/{cid}/is-first-message", headers={"x-sid": sid})
@@ -269,6 +375,12 @@ def create_chat_page():
                 # Save the user message
                 await client.post(f"/conversations/{cid}/messages", headers={"x-sid": sid},
                                   json={"role": "user", "content": user_text})
+
+                # The conversation moves to the top of the sidebar, as it does server-side
+                current = next((c for c in convs if c["id"] == cid), None)
+                if current and convs[0]["id"] != cid:
+                    convs = sidebar_upsert(convs, current)
+                    yield messages, "", gr.update(choices=sidebar_choices(convs), value=cid), convs
                 
                 # Generate AI title if this is the first message
                 if is_first_message:
@@ -283,39 +395,28 @@ def create_chat_page():
                                        params={"title": new_title})
                         print(f"✅ Generated title: '{new_title}'")
                         
-                        # Refresh conversation list to show new title immediately
-                        convs_resp = await client.get("/conversations", headers={"x-sid": sid})
-                        if convs_resp.status_code == 200:
-                            convs = convs_resp.json()
-                            choices = [(c['title'] or 'Untitled', c['id']) for c in convs]
-                            # Yield updated conversation list immediately with current conversation selected
-                            yield messages, "", gr.update(choices=choices, value=cid)
+                        # Rename in the sidebar model to show the new title immediately
+                        convs = sidebar_upsert(convs, {"id": cid, "title": new_title})
+                        yield messages, "", gr.update(choices=sidebar_choices(convs), value=cid), convs
                             
                     except Exception as e:
                         print(f"❌ Failed to generate title: {e}")
                         # Continue without title update
 
-            # Get conversation history and generate response
-            from main import app  # Import here to avoid circular imports
-            pool = app.state.pool
-            async with pool.acquire() as conn:
-                rows = await conn.fetch(
-                    "SELECT role, content FROM messages WHERE conversation_id=$1 ORDER BY id ASC LIMIT 200", cid
-                )
-                history = [{"role": r["role"], "content": r["content"]} for r in rows]
+            # Any worker generates and saves the reply; we relay it from Redis,
+            # and the answer is kept even if this client disconnects
+            reply = stream_reply(sid, cid, user_text, request_host(request))
 
             assistant_text = ""
-            async for chunk in handle_message("webuser", user_text, history, pool):
-                assistant_text += chunk
+            # Batch token deltas into frames so the browser isn't sent a diff per token
+            async for frame in coalesce_stream(reply):
+                assistant_text += frame
                 messages[-1]["content"] = assistant_text
-                yield messages, "", gr.update()
-
-            # Save assistant response
-            async with httpx.AsyncClient(base_url=BASE_URL) as client:
-                await client.post(f"/conversations/{cid}/messages", headers={"x-sid": sid},
-                                  json={"role": "assistant", "content": assistant_text})
+                yield messages, "", gr.update(), convs
 
-        txt.submit(on_send, inputs=[txt, chatbot], outputs=[chatbot, txt, conversation_list])
-        send_btn.click(on_send, inputs=[txt, chatbot], outputs=[chatbot, txt, conversation_list])
+        txt.submit(on_send, inputs=[txt, chatbot, conversation_list, sidebar],
+                   outputs=[chatbot, txt, conversation_list, sidebar])
+        send_btn.click(on_send, inputs=[txt, chatbot, conversation_list, sidebar],
+                       outputs=[chatbot, txt, conversation_list, sidebar])
 
     return chat_page
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Coalesce token deltas into UI frames"""
+import asyncio
+import time
+from core.config import STREAM_FRAME_INTERVAL_MS, STREAM_FRAME_MAX_CHARS, STREAM_FRAME_MAX_INTERVAL_MS
+
+async def coalesce_stream(
+    chunks,
+    interval_ms: int = STREAM_FRAME_INTERVAL_MS,
+    max_chars: int = STREAM_FRAME_MAX_CHARS,
+    max_interval_ms: int = STREAM_FRAME_MAX_INTERVAL_MS,
+):
+    """
+    Batch an async stream of text deltas into frames.
+
+    A frame is emitted once `interval_ms` has passed since the last one or
+    `max_chars` are buffered, whichever comes first; buffered text is also
+    flushed when the budget runs out while waiting on a slow upstream. The time the consumer
+    holds each frame (e.g. Gradio pushing it over the websocket) is measured;
+    if it exceeds the current interval both budgets are doubled (the interval
+    up to `max_interval_ms`), and they decay back towards the base values once
+    the client keeps up again.
+
+    Args:
+        chunks: Async iterable of text deltas
+        interval_ms: Base time budget per frame
+        max_chars: Size budget per frame
+        max_interval_ms: Upper bound for the adaptive interval
+
+    Yields:
+        Buffered text since the previous frame (never empty)
+    """
+    base = interval_ms / 1000
+    ceiling = max(base, max_interval_ms / 1000)
+    interval = base
+    size_budget = max_chars
+    buffer = []
+    buffered = 0
+    last_flush = time.perf_counter()
+
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            # Don't let buffered text sit through an upstream stall (tool
+            # calls, retrieval): stop waiting once the frame budget runs out.
+            # The pending read is kept, not cancelled, and picked up next time.
+            timeout = max(0, interval - (time.perf_counter() - last_flush)) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if done:
+                try:
+                    delta = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                if not delta:
+                    continue
+                buffer.append(delta)
+                buffered += len(delta)
+
+                now = time.perf_counter()
+                if buffered < size_budget and now - last_flush < interval:
+                    continue
+
+            frame = "".join(buffer)
+            buffer.clear()
+            buffered = 0
+
+            sent = time.perf_counter()
+            yield frame
+            held = time.perf_counter() - sent
+
+            # Adapt to client backpressure
+            if held > interval:
+                if interval < ceiling:
+                    interval = min(interval * 2, ceiling)
+                    size_budget *= 2
+            elif interval > base:
+                interval = max(interval / 2, base)
+                size_budget = max(size_budget // 2, max_chars)
+            last_flush = time.perf_counter()
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buffer:
+        yield "".join(buffer)